@@ -0,0 +1,479 @@
+import numpy as np
+import contact_tracing as ct
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+from time import time
+
+# Benchmarks for the hot paths of contact_tracing.py, on synthetic contact data
+# shaped like bt_symmetric.csv (~700 students, 4 weeks of 300 sec time slots),
+# optionally scaled up (scale=10 means 7000 students with the same contact rates).
+#
+# usage: python benchmark.py                     (checks the backends agree, runs all benchmarks, compares to the baseline if there is one)
+#        python benchmark.py --save-baseline     (stores the results as the new baseline)
+#
+# each benchmark runs in its own process, so that its peak memory (RSS) can be reported; the synthetic data is written
+# by another process, and each benchmark loads it itself, so the data never is in the memory of the main process
+
+baselinefile=os.path.join(os.path.dirname(os.path.abspath(__file__)),'benchmark_baseline.json')
+
+# ---------- SYNTHETIC CONTACT DATA ----------------
+
+def synthetic_contacts(scale=1,N_students=700,weeks=4,group_size=20,seed=0):
+
+    '''Returns arrays (timestamps,node_i,node_j,signalstrengths) of synthetic Bluetooth contacts:
+       every student belongs to two groups (a class and a circle of friends, say), which mixes the groups;
+       in each 300 sec slot every group meets with a probability
+       that is high on weekday daytime and low otherwise, and 2-6 of its members are then all in contact.
+       Both directions of each contact are included, like in bt_symmetric.csv.'''
+
+    rng=np.random.RandomState(seed)
+
+    N_students=N_students*scale
+    N_groups=max(1,N_students//group_size) # per layer (classes, friends)
+
+    slot_times=np.arange(0,weeks*7*ct.day,ct.timestep_in_data).astype(np.int64)
+
+    hours=(slot_times//3600)%24
+    weekdays=(slot_times//ct.day)%7
+
+    p_meeting=np.where((hours>=8)&(hours<17)&(weekdays<5),0.15,0.015)
+
+    # meetings: (slot,group) pairs, drawn slot by slot to keep memory low at large scales
+
+    timestamps=[]
+    nodes_i=[]
+    nodes_j=[]
+
+    members=np.concatenate((rng.permutation(N_students),rng.permutation(N_students))) # two layers of groups
+    group_starts=np.concatenate((np.arange(N_groups),np.arange(N_groups)))*group_size
+    group_starts[N_groups:]+=N_students # members of group g: members[group_starts[g]:group_starts[g]+group_size]
+
+    for k in xrange(0,len(slot_times)):
+
+        groups=np.flatnonzero(rng.uniform(size=2*N_groups)<p_meeting[k])
+
+        if len(groups)==0:
+
+            continue
+
+        sizes=rng.randint(2,7,size=len(groups))
+
+        # 6 different members of each meeting group, of which the first sizes[n] take part
+
+        picks=members[group_starts[groups][:,None]+np.argsort(rng.uniform(size=(len(groups),group_size)),axis=1)[:,:6]]
+
+        a,b=np.meshgrid(np.arange(6),np.arange(6),indexing='ij')
+        use=(a!=b)[None,:,:]&(a[None,:,:]<sizes[:,None,None])&(b[None,:,:]<sizes[:,None,None])
+
+        timestamps.append(np.full(use.sum(),slot_times[k],dtype=np.int64))
+        nodes_i.append(np.broadcast_to(picks[:,:,None],use.shape)[use])
+        nodes_j.append(np.broadcast_to(picks[:,None,:],use.shape)[use])
+
+    timestamps=np.concatenate(timestamps)
+    node_i=np.concatenate(nodes_i).astype(np.int64)
+    node_j=np.concatenate(nodes_j).astype(np.int64)
+
+    return timestamps,node_i,node_j,-rng.randint(60,95,size=len(timestamps)).astype(np.int64)
+
+def write_contacts_csv(filename,timestamps,node_i,node_j,signalstrengths):
+
+    '''Writes contacts in the format of bt_symmetric.csv'''
+
+    with open(filename,'w') as f:
+
+        f.write('# timestamp,user_a,user_b,rssi\n')
+
+        np.savetxt(f,np.column_stack((timestamps,node_i,node_j,signalstrengths)),fmt='%d',delimiter=',')
+
+# ---------- BENCHMARKS ----------------
+
+# each benchmark gets a directory with the synthetic data (contacts.csv, and its cache) and the scale,
+# and returns a dict of measurements; names ending with '_s' are times (lower is better),
+# names ending with '_per_s' are throughputs (higher is better)
+
+def bench_read_contacts(datadir,scale,options):
+
+    ct.path=datadir+os.sep
+
+    cachedir=os.path.join(datadir,'contacts.csv.cache')
+
+    if os.path.isdir(cachedir):
+
+        shutil.rmtree(cachedir)
+
+    t1=time()
+    network=ct.read_contacts('contacts.csv',cache=False)
+    parse=time()-t1
+
+    ct.read_contacts('contacts.csv',cache=True) # writes the cache
+
+    t1=time()
+    network=ct.read_contacts('contacts.csv',cache=True)
+    cached=time()-t1
+
+    return {'parse_s':parse,'cached_load_s':cached,'contacts_per_s':len(network)/parse}
+
+def bench_setup(datadir,scale,options):
+
+    network=load_network(datadir)
+    params=dict(ct.default_intervention_params)
+
+    repeats=max(1,options.runs//scale)
+
+    t1=time()
+
+    for run in xrange(0,repeats):
+
+        population=ct.Population(network.N_students,params,run)
+        studentlist=[ct.Node(params=params,myid=sid,currtime=0,population=population) for sid in xrange(0,network.N_students)]
+
+    return {'setup_s':(time()-t1)/repeats}
+
+def bench_transmission(datadir,scale,options):
+
+    '''Full runs without tracing: the time goes to the transmission loop and disease progression'''
+
+    network=load_network(datadir)
+    params=dict(ct.default_intervention_params,p_traced=0.0,p_app=0.0)
+
+    return time_runs(network,params,options,scale)
+
+def bench_tracing(datadir,scale,options):
+
+    '''Full runs with manual and app tracing, with the time of tracing itself from the run statistics (see ct.new_run_stats):
+       tracing_s finding and quarantining the contacts of traced students and recording_s recording the contacts for it,
+       per run, and tracing_call_s per contact tracing. index_s is the time of making the student index of the network
+       for tracing, once per network (see ct.ContactTrace), before the runs'''
+
+    network=load_network(datadir)
+    params=dict(ct.default_intervention_params,p_traced=0.75,p_app=0.5)
+
+    t1=time()
+    network.students_between(0,0)
+    index=time()-t1
+
+    results=time_runs(network,params,options,scale,profile=True)
+    results['index_s']=index
+
+    return results
+
+def bench_compiled(datadir,scale,options):
+
+    '''Full runs with tracing with the compiled backend (the python backend if numba is not installed); compare with tracing'''
+
+    network=load_network(datadir)
+    params=dict(ct.default_intervention_params,p_traced=0.75,p_app=0.5)
+
+    ct.SEIR_onerun_grid(network,params=params,p_transmission=options.p_transmission,rng=0,backend='compiled') # compiles the kernel
+
+    return time_runs(network,params,options,scale,backend='compiled')
+
+def bench_sweep(datadir,scale,options):
+
+    '''The 11x11 grid of episizes_tracing_cluster with options.sweep_iterations runs per point (at its default p_transmission)'''
+
+    network=load_network(datadir)
+    params=dict(ct.default_intervention_params)
+
+    stdout=sys.stdout
+    sys.stdout=open(os.devnull,'w') # the sweep prints its results
+
+    try:
+
+        t1=time()
+        ct.episizes_tracing_cluster(network,params,iterations=options.sweep_iterations,processes=options.processes,base_seed=0)
+        elapsed=time()-t1
+
+    finally:
+
+        sys.stdout.close()
+        sys.stdout=stdout
+
+    return {'sweep_s':elapsed,'runs_per_s':121*options.sweep_iterations/elapsed}
+
+def prepare_data(datadir,scale,options):
+
+    '''Writes the synthetic data at scale into datadir (contacts.csv and its cache, loaded by the benchmarks)'''
+
+    write_contacts_csv(os.path.join(datadir,'contacts.csv'),*synthetic_contacts(scale=scale))
+
+    load_network(datadir) # writes the cache
+
+    return {}
+
+benchmarks=[('read_contacts',bench_read_contacts),('setup',bench_setup),('transmission',bench_transmission),('tracing',bench_tracing),('compiled',bench_compiled),('sweep',bench_sweep)]
+
+def load_network(datadir):
+
+    ct.path=datadir+os.sep
+
+    return ct.read_contacts('contacts.csv')
+
+def time_runs(network,params,options,scale,backend='python',profile=False):
+
+    '''Times options.runs//scale runs; with profile, also sums the tracing times of their run statistics'''
+
+    runs=max(1,options.runs//scale)
+
+    infected=0
+
+    stats={} if profile else None
+    totals=defaultdict(float)
+
+    t1=time()
+
+    for run in xrange(0,runs):
+
+        infected+=ct.SEIR_onerun_grid(network,params=params,p_transmission=options.p_transmission,rng=run,stats=stats,backend=backend)[0]
+
+        if profile:
+
+            for name in ['time_tracing','time_recording','tracing_calls']:
+
+                totals[name]+=stats[name]
+
+    elapsed=time()-t1
+
+    results={'run_s':elapsed/runs,'runs_per_s':runs/elapsed,'mean_infected':float(infected)/runs}
+
+    if profile:
+
+        results.update(tracing_s=totals['time_tracing']/runs,recording_s=totals['time_recording']/runs,tracing_calls=totals['tracing_calls']/runs,
+                       tracing_call_s=totals['time_tracing']/max(1,totals['tracing_calls']))
+
+    return results
+
+# ---------- RUNNING AND COMPARING ----------------
+
+def _run_in_child(benchmark,datadir,scale,options,queue):
+
+    results=benchmark(datadir,scale,options)
+    results['peak_rss_mb']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0 # kB on Linux
+
+    queue.put(results)
+
+def run_benchmark(benchmark,datadir,scale,options):
+
+    '''Runs benchmark in a separate process and returns its results including its peak memory'''
+
+    queue=multiprocessing.Queue()
+
+    child=multiprocessing.Process(target=_run_in_child,args=(benchmark,datadir,scale,options,queue))
+    child.start()
+
+    results=queue.get()
+
+    child.join()
+
+    return results
+
+def compare(results,baseline,tolerance):
+
+    '''Returns a list of (key,measurement,value,baseline value) that are worse than the baseline by more than tolerance (fraction)'''
+
+    regressions=[]
+
+    for key in sorted(results):
+
+        for measurement,value in sorted(results[key].items()):
+
+            if not(key in baseline and measurement in baseline[key]):
+
+                continue
+
+            old=baseline[key][measurement]
+
+            if measurement.endswith('_per_s'):
+
+                worse=value<old*(1.0-tolerance)
+
+            elif measurement.endswith('_s') or measurement=='peak_rss_mb':
+
+                worse=value>old*(1.0+tolerance)
+
+            else:
+
+                worse=False
+
+            if worse:
+
+                regressions.append((key,measurement,value,old))
+
+    return regressions
+
+def cross_validate(options):
+
+    '''Compares the distributions of the results of the python and compiled backends (see ct.compare_backends);
+       returns 1 if they differ significantly (p<0.01 in a Kolmogorov-Smirnov test), otherwise 0'''
+
+    if ct.numba is None:
+
+        print "numba is not installed, so there is no compiled backend to compare"
+
+        return 0
+
+    datadir=tempfile.mkdtemp(prefix='contact_tracing_bench')
+
+    failed=False
+
+    try:
+
+        write_contacts_csv(os.path.join(datadir,'contacts.csv'),*synthetic_contacts())
+
+        network=load_network(datadir)
+
+        for p_traced,p_app in [(0.0,0.0),(0.75,0.5)]:
+
+            params=dict(ct.default_intervention_params,p_traced=p_traced,p_app=p_app)
+
+            comparison=ct.compare_backends(network,params,options.cross_validate,options.p_transmission)
+
+            for name in ct.result_names:
+
+                python_mean,compiled_mean,statistic,p_value=comparison[name]
+
+                print "p_traced=%.2f p_app=%.2f %s: python %.4g compiled %.4g (KS %.3f, p=%.3f)" % (p_traced,p_app,name,python_mean,compiled_mean,statistic,p_value)
+
+                failed|=p_value<0.01
+
+    finally:
+
+        shutil.rmtree(datadir,ignore_errors=True)
+
+    print "Backends DIFFER" if failed else "Backends agree"
+
+    return 1 if failed else 0
+
+def check_backends(runs=200,p_transmission=0.01):
+
+    '''Asserts that the python and compiled backends give the same distributions of results (no Kolmogorov-Smirnov p<0.01,
+       see ct.compare_backends) on a small synthetic network (140 students, 2 weeks), with and without tracing.
+       The data and the runs are seeded, so the check is deterministic; main runs it before the benchmarks'''
+
+    if ct.numba is None:
+
+        return
+
+    network=ct.ContactNetwork(*synthetic_contacts(N_students=140,weeks=2,group_size=10)[:3])
+
+    for p_traced,p_app in [(0.0,0.0),(0.75,0.5)]:
+
+        params=dict(ct.default_intervention_params,p_traced=p_traced,p_app=p_app)
+
+        comparison=ct.compare_backends(network,params,runs,p_transmission)
+
+        for name in ct.result_names:
+
+            python_mean,compiled_mean,statistic,p_value=comparison[name]
+
+            assert p_value>=0.01,"the backends differ in %s at p_traced=%.2f p_app=%.2f: python %.4g compiled %.4g (KS p=%.3g)" % (name,p_traced,p_app,python_mean,compiled_mean,p_value)
+
+    print "Backends agree"
+
+def main(argv=None):
+
+    parser=argparse.ArgumentParser(description='Benchmarks of contact_tracing.py on synthetic contact data')
+
+    parser.add_argument('--scales',default='1,10,100',help='comma separated scale factors (number of students / 700)')
+    parser.add_argument('--benchmarks',default=','.join(name for name,benchmark in benchmarks),help='comma separated benchmarks to run')
+    parser.add_argument('--runs',type=int,default=20,help='runs per timing at scale 1 (divided by the scale)')
+    parser.add_argument('--sweep-iterations',type=int,default=1,help='runs per grid point in the sweep benchmark')
+    parser.add_argument('--sweep-max-scale',type=int,default=1,help='largest scale at which the sweep benchmark is run')
+    parser.add_argument('--processes',type=int,default=1,help='processes for the sweep benchmark')
+    parser.add_argument('--p-transmission',type=float,default=0.05,help='transmission probability (the synthetic data is sparser than the real one)')
+    parser.add_argument('--baseline',default=baselinefile,help='baseline file')
+    parser.add_argument('--save-baseline',action='store_true',help='store the results as the new baseline')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='flag results worse than the baseline by more than this fraction')
+    parser.add_argument('--cross-validate',type=int,default=0,metavar='RUNS',help='only compare the results of the python and compiled backends in RUNS runs each (at scale 1)')
+
+    options=parser.parse_args(argv)
+
+    if options.cross_validate>0:
+
+        return cross_validate(options)
+
+    checking=multiprocessing.Process(target=check_backends) # not in this process, whose memory the benchmarks would inherit
+    checking.start()
+    checking.join()
+
+    if checking.exitcode!=0:
+
+        print "Backends DIFFER"
+
+        return 1
+
+    scales=[int(scale) for scale in options.scales.split(',')]
+    selected=options.benchmarks.split(',')
+
+    results={}
+
+    for scale in scales:
+
+        datadir=tempfile.mkdtemp(prefix='contact_tracing_bench')
+
+        try:
+
+            t1=time()
+            run_benchmark(prepare_data,datadir,scale,options)
+            print "scale %d: synthetic data in %.1f s" % (scale,time()-t1)
+
+            for name,benchmark in benchmarks:
+
+                if not(name in selected) or (name=='sweep' and scale>options.sweep_max_scale):
+
+                    continue
+
+                key='%s@%d' % (name,scale)
+
+                results[key]=run_benchmark(benchmark,datadir,scale,options)
+
+                print key+'\t'+'\t'.join('%s=%.4g' % item for item in sorted(results[key].items()))
+
+                sys.stdout.flush()
+
+        finally:
+
+            shutil.rmtree(datadir,ignore_errors=True)
+
+    if options.save_baseline:
+
+        with open(options.baseline,'w') as f:
+
+            json.dump(results,f,indent=1,sort_keys=True)
+
+        print "Baseline saved to "+options.baseline
+
+        return 0
+
+    if not os.path.exists(options.baseline):
+
+        print "No baseline (run with --save-baseline to store one)"
+
+        return 0
+
+    with open(options.baseline) as f:
+
+        baseline=json.load(f)
+
+    regressions=compare(results,baseline,options.tolerance)
+
+    for key,measurement,value,old in regressions:
+
+        print "REGRESSION %s %s: %.4g (baseline %.4g)" % (key,measurement,value,old)
+
+    if len(regressions)==0:
+
+        print "No regressions against "+options.baseline
+
+    return 1 if len(regressions)>0 else 0
+
+if __name__=="__main__":
+
+    sys.exit(main())
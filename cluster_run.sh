@@ -5,5 +5,7 @@
 #SBATCH --array=0-100
 #SBATCH --time=04:30:00
 #SBATCH --mem=1G
+#SBATCH --requeue
+#SBATCH --open-mode=truncate
 
 python contact_tracing.py
@@ -0,0 +1,20 @@
+#!/bin/bash
+#SBATCH --job-name=contact_tracing_workers
+#SBATCH --output=contact_tracing_worker_%A_%a.out
+#SBATCH --array=0-19
+#SBATCH --cpus-per-task=4
+#SBATCH --time=04:30:00
+#SBATCH --mem=2G
+#SBATCH --requeue
+
+# workers of a coordinated sweep: make a secret and start the coordinator first (on a node the workers can reach), e.g.
+#   export SWEEP_AUTHKEY=$(python -c 'import os; print os.urandom(16).encode("hex")')
+#   python contact_tracing.py --coordinator $(hostname):5000 [sweep.json]
+# and then, in the same shell (sbatch passes the environment on), submit the workers with
+#   COORDINATOR=host:5000 sbatch cluster_workers.sh
+
+: ${SWEEP_AUTHKEY:?"set SWEEP_AUTHKEY to the secret of the coordinator"}
+
+export SWEEP_AUTHKEY
+
+python contact_tracing.py --worker $COORDINATOR
@@ -1,19 +1,34 @@
 import numpy as np
-from random import random
-from random import seed as seed_rn
-from numpy.random import normal,seed
-from numpy.random import choice
-from numpy.random import rand
 import pylab
 from scipy.stats import binned_statistic
+import copy
 import csv
-from collections import deque,defaultdict
-from time import time
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import sys
+import threading
+from collections import defaultdict,Counter,deque
+from heapq import heappush,heappop
+from time import time,sleep
+
+try:
+
+    import numba # optional, for the compiled backend (see SEIR_onerun_grid)
+
+except ImportError:
+
+    numba=None
 
 # ------------- TIME-RELATED PARAMETERS -------------------------
 
 day=24*60*60 # one day in seconds
 
+week=7*day # the interleaving intervention (oddweeks) alternates weeks of simulation time, from time 0 of the data
+
 timestep_in_data=300.0 # time steps in data are 300 sec each
 
 # ---------- DEFAULT INTERVENTION PARAMETERS --------------------
@@ -61,6 +76,7 @@ p_severesymptoms=0.1*(1-p_asymptomatic)
 
 I_classes=['Ias','Ips','Ims','Iss']
 I_probs=[p_asymptomatic,p_paucisymptomatic,p_mildsymptoms,p_severesymptoms]
+I_cumprobs=np.cumsum(I_probs) # for drawing the Iclass from a single uniform number
 
 infectious_period=7.5*day-incubation_period
 
@@ -73,10 +89,168 @@ inputfile='bt_symmetric.csv' # USE ORIGINAL FILE FROM THE SCIENTIFIC DATA PAPER
 
 path='/m/cs/scratch/networks/jsaramak/spreading' # REPLACE WITH YOUR OWN PATH TO DATA
 
+# ---------- STATE ARRAYS ----------------
+
+# during a run the state of all students is kept in arrays (see class Population)
+# so that the contacts of a time slot can be handled at once with numpy;
+# states are stored as integer codes, state_names[code] gives the name
+
+state_names=['S','E','Ip','Ias','Ips','Ims','Iss','R']
+state_codes=dict((name,code) for code,name in enumerate(state_names))
+
+infectious_states=[name in ['Ip','Ias','Ips','Ims','Iss'] for name in state_names] # infectious_states[code]: infectious only in these states
+
+# events in the event queue are (time,student,code): a state change to state code,
+# or one of the quarantine and tracing events below (codes after the state codes)
+
+event_names=state_names+['BOQ','BOQ_t','EOQ','CT'] # beginning of quarantine (tested / traced), end of quarantine, contact tracing
+event_codes=dict((name,code) for code,name in enumerate(event_names))
+
+def make_rng(rng=None):
+
+    '''Returns the random number generator of a run: rng itself if it already is a numpy RandomState or Generator,
+       otherwise a new RandomState seeded with rng (None, an int or a sequence of ints such as (base_seed,i,j,iteration))'''
+
+    if hasattr(rng,'normal'):
+
+        return rng
+
+    return np.random.RandomState(rng)
+
+def random_integer(rng,high):
+
+    '''Returns a random integer in [0,high) drawn from rng, a numpy RandomState or Generator (see make_rng)'''
+
+    if hasattr(rng,'integers'): # a Generator
+
+        return int(rng.integers(0,high,dtype=np.int64))
+
+    return int(rng.randint(0,high,dtype=np.int64))
+
+def _mix64(x): # the splitmix64 finalizer: scrambles the bits of an array of uint64, in place
+
+    x^=x>>np.uint64(30)
+    x*=np.uint64(0xBF58476D1CE4E5B9)
+    x^=x>>np.uint64(27)
+    x*=np.uint64(0x94D049BB133111EB)
+    x^=x>>np.uint64(31)
+
+    return x
+
+def common_uniforms(key,students_i,students_j,times):
+
+    '''Returns a uniform random number in [0,1) for each contact (arrays of students_i, students_j and contact times,
+       as the contact is stored in the network) as a hash of key (a uint64, or an array of them) and the contact:
+       a counter-based generator, so that the same contact gets the same number in every run with the same key,
+       whatever happened before it (see Population, common_rng). The contacts (i,j) and (j,i) at the same time,
+       both in the data, get different numbers, as independent transmission attempts'''
+
+    # as splitmix64, which scrambles key+k*(an odd constant) for its k-th number: one round of _mix64 on
+    # key+time*(one odd constant)+(i,j)*(another), with the two students packed into one uint64
+
+    x=np.asarray(times).astype(np.uint64)*np.uint64(0x9E3779B97F4A7C15)
+    x+=np.asarray(key,dtype=np.uint64)
+    x+=((np.asarray(students_i).astype(np.uint64)<<np.uint64(32))|np.asarray(students_j).astype(np.uint64))*np.uint64(0xD1B54A32D192ED03)
+
+    x=_mix64(x)
+
+    return (x>>np.uint64(11)).astype(float)*(1.0/2**53)
+
+class Population(object):
+
+    '''Per-student state of one run as arrays indexed by student (dense index), shared with the Node objects.
+       rng is the run's random number generator; all random draws of the run go through it, unless common_rng is given.
+       Transmissions are drawn with common_uniforms from self.transmission_key (drawn from rng, or from common_rng), one
+       for each contact (i,j,time), so that they do not depend on how the contacts are cut into blocks (see advance_run).
+       common_rng (a seed) gives common random numbers for comparing interventions: the student properties, the disease
+       timeline of each student (drawn for all students here, see Node.exposure), patient zero and the start time
+       (drawn from self.common_rng) and the transmissions (common_uniforms with self.transmission_key) then only depend
+       on common_rng, and rng is only used for the intervention (tracing). So runs with the same common_rng differ
+       only because of their interventions.'''
+
+    def __init__(self,N_students,params=default_intervention_params,rng=None,common_rng=None):
+
+        self.N_students=N_students
+
+        self.state=np.zeros(N_students,dtype=np.int8)         # state codes, all start as S
+        self.infectious=np.zeros(N_students,dtype=bool)       # True if the student can infect others
+        self.dampingfactor=np.ones(N_students,dtype=float)    # set to <1.0 for asymptomatics etc
+        self.in_quarantine=np.zeros(N_students,dtype=bool)    # True: doesn't affect anyone else's state
+        self.recovery_time=np.zeros(N_students,dtype=np.int64) # when the student recovers, once exposed
+        self.quarantine_end=np.zeros(N_students,dtype=np.int64) # when the latest quarantine of the student ends
+
+        self.studentlist=None # the Nodes of the students, made once (see students) and kept over resets
+
+        self.reset(params,rng,common_rng)
+
+    def reset(self,params=default_intervention_params,rng=None,common_rng=None):
+
+        '''Sets up the population for a new run, as if it was new: everyone S and out of quarantine, and the random properties
+           drawn again with the new rng or common_rng; the arrays and Nodes are reused'''
+
+        N_students=self.N_students
+
+        self.rng=make_rng(rng)
+
+        if common_rng is None:
+
+            self.common_rng=self.rng     # patient zero and the start time
+            self.timelines=None          # disease timelines are drawn at exposure
+            self.transmission_key=np.uint64(random_integer(self.rng,2**63-1)) # the key of the transmissions
+
+        else:
+
+            if hasattr(common_rng,'normal'):
+
+                raise ValueError("common_rng must be a seed, not a random number generator")
+
+            self.common_rng=make_rng(common_rng)
+
+        self.state.fill(state_codes['S'])
+        self.infectious.fill(False)
+        self.dampingfactor.fill(1.0)
+        self.in_quarantine.fill(False)
+        self.recovery_time.fill(0)
+        self.quarantine_end.fill(0)
+
+        # randomly chosen properties, drawn for all students at once
+
+        draws=self.common_rng.uniform(size=(3,N_students))
+
+        self.oddweek=(draws[0]>=0.5).astype(int)              # 0 or 1, meaning present on odd or even weeks, for the interleaving strategy
+        self.has_mask=draws[1]<params['p_mask']               # whether the student wears a mask
+        self.app_draws=draws[2]                               # kept for forks with other p_app (see RunState.fork)
+        self.has_app=draws[2]<params['p_app']
+
+        self.mask_factor_out=np.where(self.has_mask,params['mask_reduction_out'],1.0)
+        self.mask_factor_in=np.where(self.has_mask,params['mask_reduction_in'],1.0)
+
+        if not(common_rng is None):
+
+            # the random numbers of the disease timeline of each student (see Node.exposure), and the key of the transmissions
+
+            self.timelines=np.column_stack((self.common_rng.normal(size=(N_students,4)),self.common_rng.uniform(size=(N_students,2))))
+
+            self.transmission_key=np.uint64(random_integer(self.common_rng,2**63-1))
+
+    def students(self,params=default_intervention_params):
+
+        '''Returns the list of the Nodes of the students (studentlist[i] is student i), made on the first call'''
+
+        if self.studentlist is None:
+
+            self.studentlist=[Node(params=params,myid=sid,currtime=0,population=self) for sid in xrange(0,self.N_students)]
+
+        return self.studentlist
+
 # ---------- NODE CLASS DEFINITION ----------------
 
 # usage: upon initialization, set to state S
-# some properties are randomly chosen (has app, wears mask, etc)
+# some properties are randomly chosen (has app, wears mask, etc) when the Population is created
+# state, infectious, dampingfactor, in_quarantine and the properties are stored in the Population
+# (a population of one is created if none is given), random draws use its rng;
+# a Node itself has no state of its own, so it is reused for the next run (see Population.reset);
+# the contacts of the run are recorded for tracing in a ContactTrace
 #
 # when exposed, call Node.exposure(event_queue,current_time)
 # this computes a random timeline to Ip, I, R
@@ -84,95 +258,153 @@ path='/m/cs/scratch/networks/jsaramak/spreading' # REPLACE WITH YOUR OWN PATH TO
 # it also computes whether the student will be tested
 # and if, places the beginning of the quarantine in the event queue too
 
-class Node:
+class Node(object):
+
+    __slots__=('index','population','id')
+
+    def __init__(self,params,myid=0,currtime=0,population=None):
 
-    def __init__(self,params,myid=0,currtime=0):
+        if population is None:
+
+            population=Population(1,params)
+            self.index=0            # position in the population arrays
+
+        else:
+
+            self.index=myid
+
+        self.population=population
+        self.id=myid                # student id
+
+        self.reset()
+
+    def reset(self): # back to state S out of quarantine, for a new run (the properties are drawn by Population.reset)
 
         self.state='S'              # S,E,I,R
         self.infectious=False       # True if the student can infect others
         self.dampingfactor=1.0      # set to <1.0 for asymptomatics etc
-        self.contacts={}            # tracedcontacts (dict[student_id]=[time_1,time_2])
-        self.contact_has_app=set()  # set of contacts who are known to use app, only used if self has app
         self.in_quarantine=False    # True: doesn't affect anyone else's state
-        self.id=myid                # student id
-        self.oddweek=int(round(random())) # 0 or 1, meaning present on odd or even weeks, for the interleaving strategy
 
-        if random()<params['p_mask']: # whether the student wears a mask
+    # properties and state kept in the population arrays
 
-            self.has_mask=True
-            self.mask_factor_out=params['mask_reduction_out']
-            self.mask_factor_in=params['mask_reduction_in']
+    @property
+    def rng(self): # random number generator of the run
 
-        else:
+        return self.population.rng
 
-            self.has_mask=False
-            self.mask_factor_out=1.0
-            self.mask_factor_in=1.0
+    @property
+    def oddweek(self): # 0 or 1, meaning present on odd or even weeks, for the interleaving strategy
 
-        if random()<params['p_app']:
+        return int(self.population.oddweek[self.index])
 
-            self.has_app=True
+    @property
+    def has_mask(self):
 
-        else:
+        return bool(self.population.has_mask[self.index])
 
-            self.has_app=False
+    @property
+    def mask_factor_out(self):
 
-    def reset(self,myid=0,currtime=0):
+        return float(self.population.mask_factor_out[self.index])
 
-        self.state='S'
-        self.infectious=False
-        self.dampingfactor=1.0
-        self.contacts=[]
-        self.in_quarantine=False
-        self.id=myid
-        
-    def statechange(self,eventq,newstate,currtime,params,students_with_apps): # changes the state of the student and modifies event dict accordingly
+    @property
+    def mask_factor_in(self):
 
-        if newstate=='EOQ':
+        return float(self.population.mask_factor_in[self.index])
 
-            self.in_quarantine=False
+    @property
+    def has_app(self):
 
-        elif newstate=='BOQ' or newstate=='BOQ_t':
+        return bool(self.population.has_app[self.index])
 
-            if not(self.in_quarantine):
+    @property
+    def state(self):
 
-                self.set_quarantine(eventq,currtime,params) # sets self in quarantine and adds end of quarantine to event dict; also does contact tracing
+        return state_names[self.population.state[self.index]]
 
-        elif newstate=='CT':
+    @state.setter
+    def state(self,newstate):
 
-            self.trace_contacts(eventq,currtime,params,students_with_apps) # traces contacts and places (some of) them in quarantine
+        self.population.state[self.index]=state_codes[newstate]
 
-        else:
+    @property
+    def infectious(self):
 
-            self.state=newstate
+        return bool(self.population.infectious[self.index])
 
-            if self.state in ['Ip','Ias','Ips','Ims','Iss']: # infectious only in these states
+    @infectious.setter
+    def infectious(self,value):
 
-                self.infectious=True
+        self.population.infectious[self.index]=value
 
-            else:
+    @property
+    def dampingfactor(self):
+
+        return float(self.population.dampingfactor[self.index])
+
+    @dampingfactor.setter
+    def dampingfactor(self,value):
+
+        self.population.dampingfactor[self.index]=value
+
+    @property
+    def in_quarantine(self):
+
+        return bool(self.population.in_quarantine[self.index])
+
+    @in_quarantine.setter
+    def in_quarantine(self,value):
+
+        self.population.in_quarantine[self.index]=value
+        
+    def statechange(self,eventq,newstate,currtime,params,students_with_apps): # changes the state of the student (newstate is an event code) and modifies event queue accordingly; CT events are handled by the run (see ContactTrace)
+
+        if newstate==event_codes['EOQ']:
+
+            self.in_quarantine=False
+
+        elif newstate==event_codes['BOQ'] or newstate==event_codes['BOQ_t']:
+
+            if not(self.in_quarantine):
+
+                self.set_quarantine(eventq,currtime,params) # sets self in quarantine and adds end of quarantine to event queue; also does contact tracing
+
+        else:
+
+            self.population.state[self.index]=newstate
 
-                self.infectious=False
+            self.infectious=infectious_states[newstate]
        
     def exposure(self,eventq,currtime,params): # sets the student to the exposed state and modifies the timeline, precomputing times to other states
 
         self.state='E'
 
+        # all random numbers of the timeline at once: standard normals for the durations, uniforms for the Iclass and testing
+
+        if self.population.timelines is None:
+
+            z_ip,z_i,z_test,z_r=self.rng.normal(size=4)
+            u_class,u_test=self.rng.uniform(size=2)
+
+        else: # common random numbers: the same timeline in all runs with the same common_rng
+
+            z_ip,z_i,z_test,z_r,u_class,u_test=self.population.timelines[self.index]
+
         # calculate time to I_p
 
-        time_to_ip=int(timestep_in_data*round((currtime+normal(loc=latency_period,scale=latency_period/10.0))/timestep_in_data))
+        time_to_ip=int(timestep_in_data*round((currtime+latency_period+z_ip*latency_period/10.0)/timestep_in_data))
 
-        eventq[time_to_ip].append((self.id,'Ip'))
+        eventq.add(time_to_ip,self.id,event_codes['Ip'])
         
         # calculate time to I
 
-        time_to_i=int(timestep_in_data*round((time_to_ip+normal(loc=prodromal_period,scale=prodromal_period/10.0))/timestep_in_data))
+        time_to_i=int(timestep_in_data*round((time_to_ip+prodromal_period+z_i*prodromal_period/10.0)/timestep_in_data))
 
         # choose Iclass (asymptomatic, pausisymptomatic, mild symptoms, ...)
 
-        Iclass=choice(I_classes,1,p=I_probs)[0]
+        Iclass=I_classes[min(np.searchsorted(I_cumprobs,u_class,side='right'),len(I_classes)-1)]
 
-        eventq[time_to_i].append((self.id,Iclass))
+        eventq.add(time_to_i,self.id,event_codes[Iclass])
 
         # set infectiousness factor
 
@@ -190,75 +422,62 @@ class Node:
 
         if not(Iclass=='Ias'):
 
-            if Iclass=='Iss' or random()<params['p_tested']:
+            if Iclass=='Iss' or u_test<params['p_tested']:
 
-                time_to_testing=int(timestep_in_data*round((time_to_i+normal(loc=params['test_delay'],scale=params['test_delay']/10.0))/timestep_in_data))
+                time_to_testing=int(timestep_in_data*round((time_to_i+params['test_delay']+z_test*params['test_delay']/10.0)/timestep_in_data))
                        
                 if not(self.in_quarantine):
 
-                    eventq[time_to_testing].append((self.id,'BOQ')) # tested and goes to quarantine at time_to_testing
+                    eventq.add(time_to_testing,self.id,event_codes['BOQ']) # tested and goes to quarantine at time_to_testing
 
-                eventq[time_to_testing+int(timestep_in_data)].append((self.id,'CT')) # do contact tracing when quarantine begins
+                eventq.add(time_to_testing+int(timestep_in_data),self.id,event_codes['CT']) # do contact tracing when quarantine begins
 
 
         # calculate time to H/ICU/R; for our purposes the same since all are removed from the contact network
 
-        time_to_r=int(timestep_in_data*round((time_to_i+normal(loc=infectious_period,scale=infectious_period/10.0))/timestep_in_data))
-
-        eventq[time_to_r].append((self.id,'R'))
+        time_to_r=int(timestep_in_data*round((time_to_i+infectious_period+z_r*infectious_period/10.0)/timestep_in_data))
 
+        eventq.add(time_to_r,self.id,event_codes['R'])
 
-    def add_contact(self,student_id,curr_time,tracelength): # adds one contact (time,id) to the contact trace
+        self.population.recovery_time[self.index]=time_to_r
 
-        self.contacts[student_id].append(curr_time)
 
-    def flush_contacts(self,curr_time,params): # removes all contacts that are older than tracelength
+    def quarantine_contacts(self,contacts,eventq,curr_time,params,students_with_apps): # places the traced contacts (contacts[student_id]=number of time slots together, see ContactTrace.trace) in quarantine, if recalled or found by the app
 
-        for contact in self.contacts: # loop thru each contact's list of contact times, pop every contact time that's too old
+        # random numbers for all contacts at once: whether recalled correctly, and the delay before quarantine
 
-            while len(self.contacts[contact])>0 and (curr_time-self.contacts[contact][0])>params['tracelength']: 
+        traced=list(contacts)
 
-                self.contacts[contact].popleft()
+        recalled=self.rng.uniform(size=len(traced))<params['p_traced'] # contact detected/recalled correctly w probability p_traced
+        z_delays=self.rng.normal(size=len(traced))
 
-    def trace_contacts(self,eventq,curr_time,params,students_with_apps): # contact tracing.
+        for n in xrange(0,len(traced)):
 
-        for contact in self.contacts:
-
-            while len(self.contacts[contact])>0 and self.contacts[contact][0]<(curr_time-params['tracelength']): 
-
-                self.contacts[contact].popleft()  
+            contact=traced[n]
 
             # check if manual works
 
             put_in_quarantine=False
 
-            if len(self.contacts[contact])>params['manual_tracing_threshold']: # if present in at least this many 5-min time slots
+            if contacts[contact]>params['manual_tracing_threshold']: # if present in at least this many 5-min time slots
 
-                if random()<params['p_traced']: # contact detected/recalled correctly w probability p_traced
+                if recalled[n]:
 
                     put_in_quarantine=True
-                    quarantine_time=int(timestep_in_data*round((curr_time+normal(loc=params['trace_delay_manual'],scale=params['trace_delay_manual']/10.0))/timestep_in_data))
+                    quarantine_time=int(timestep_in_data*round((curr_time+params['trace_delay_manual']+z_delays[n]*params['trace_delay_manual']/10.0)/timestep_in_data))
 
             # check if app-based works if app and manual didn't
 
-            if self.has_app and (contact in students_with_apps) and len(self.contacts[contact])>params['app_tracing_threshold'] and not(put_in_quarantine):
+            if self.has_app and (contact in students_with_apps) and contacts[contact]>params['app_tracing_threshold'] and not(put_in_quarantine):
 
                 put_in_quarantine=True
-                quarantine_time=int(timestep_in_data*round((curr_time+normal(loc=params['trace_delay_app'],scale=params['trace_delay_app']/10.0))/timestep_in_data))
+                quarantine_time=int(timestep_in_data*round((curr_time+params['trace_delay_app']+z_delays[n]*params['trace_delay_app']/10.0)/timestep_in_data))
 
             # if either worked, quarantine
 
             if put_in_quarantine:
 
-                if quarantine_time in eventq:
-
-                    if not((contact,'BOQ_t') in eventq[quarantine_time]): # to avoid adding multiple beginnings (if already added from some other contact list)
-
-                        eventq[quarantine_time].append((contact,'BOQ_t')) # place contact in quarantine
-
-                else:
-
-                        eventq[quarantine_time]=[(contact,'BOQ_t')]
+                eventq.add(quarantine_time,contact,event_codes['BOQ_t']) # place contact in quarantine (added only once even if traced from several contact lists)
        
     def set_quarantine(self,eventq,curr_time,params,trace=False): 
 
@@ -266,371 +485,4311 @@ class Node:
 
         eoq_time=int(timestep_in_data*round((curr_time+params['quarantine_length'])/timestep_in_data)) # time when quarantine ends
 
-        eventq[eoq_time].append((self.id,'EOQ'))
+        eventq.add(eoq_time,self.id,event_codes['EOQ'])
+
+        self.population.quarantine_end[self.index]=eoq_time
 
         self.in_quarantine=True
 
- 
-# --------------- AUX FUNCTIONS ----------------
+    def fork(self,population): # returns a copy of self in population (a copy of self.population, see RunState.fork)
 
-def read_contacts(filename=inputfile): # reads the contact event list to dict[timestamp]=[(node_i,node_j),...]
+        node=Node.__new__(Node) # without __init__, which would reset the state in population
 
-    '''Returns a dict of events eventdict[timestamp]=[(node_1,node_2),..]
-       and a set of student id's encountered in all events.'''
+        node.index=self.index
+        node.id=self.id
+        node.population=population
 
-    fn=open(path+filename,'rU')
+        return node
 
-    f=csv.reader(fn,delimiter=',')
+# ---------- EVENT QUEUE CLASS DEFINITION ----------------
 
-    contactdict={}
-    student_ids=set()
+# usage: eventq.add(time,student_id,event_code) schedules an event (see event_names),
+# eventq.next_time() gives the time of the earliest event, so that the main loop can jump straight to it,
+# and eventq.pop_events(time) returns the events at that time in the order they were added
+# (including events added for the same time while they are being handled)
 
-    f.next() # skip header line
+class EventQueue(object):
 
-    while True:
+    def __init__(self):
 
-        try:
+        self.heap=[]                     # binary heap of (time,n,student_id,event_code); n keeps events in order of adding
+        self.n_added=0
+        self.traced=defaultdict(set)     # traced[time]=students with a BOQ_t event at time, so that it is added only once
+        self.counts=[0]*len(event_names) # counts[event_code]=number of events with the code in the queue (see has_events)
+        self.timed_counts=Counter()      # timed_counts[(time,event_code)]=number of events with the code at time
 
-            line=f.next()
+    def __len__(self):
 
-            timestamp=int(line[0])
-            node_i=int(line[1])
-            node_j=int(line[2])
-            signalstrength=int(line[3])
+        return len(self.heap)
 
-            if node_j>=0:
+    def add(self,time,student,event):
 
-                # add any filter rules here if req'd
+        if event==event_codes['BOQ_t']:
 
-                if timestamp in contactdict:
+            if student in self.traced[time]: # to avoid adding multiple beginnings (if already added from some other contact list)
 
-                    contactdict[timestamp].append((node_i,node_j))
+                return
 
-                else:
+            self.traced[time].add(student)
 
-                    contactdict[timestamp]=[(node_i,node_j)]
+        heappush(self.heap,(time,self.n_added,student,event))
 
-                student_ids.add(node_i)
-                student_ids.add(node_j)
-    
-        except:
+        self.n_added+=1
 
-            break
+        self.counts[event]+=1
+        self.timed_counts[(time,event)]+=1
 
-    return contactdict,student_ids
+    def copy(self):
 
-def read_cluster(filename_root,filename_upto,datapath='your_path_here',normalizer=692.0):
+        '''Returns a copy of the queue, with the same events'''
 
-    '''Reads and averages data written by episizes_tracing_cluster into dictionaries''' 
+        eventq=EventQueue()
 
-    epidict=defaultdict(float) # epidemic sizes
-    redudict=defaultdict(float) # epidemic reduction
-    qdict=defaultdict(float) # fraction in quarantine
-    fpdict=defaultdict(float) # fraction non-infected in quarantine
-    Ndict=defaultdict(float) # N (for normalizing averages)
+        eventq.heap=list(self.heap)
+        eventq.n_added=self.n_added
+        eventq.traced=defaultdict(set,((time,set(students)) for time,students in self.traced.items()))
+        eventq.counts=list(self.counts)
+        eventq.timed_counts=Counter(self.timed_counts)
 
-    for i in xrange(0,filename_upto+1):
+        return eventq
 
-        filename=filename_root+"_"+str(i)+".out"
- 
-        fn=open(datapath+filename,'rU')
+    def has_events(self,events,time=None):
 
-        f=csv.reader(fn,delimiter='\t')
+        '''True if an event with one of the codes in events is scheduled (at time, or at any time if time is None);
+           from the counts of the events by code, without looking at the queue'''
 
-        while True:
+        if time is None:
 
-            try:
+            return any(self.counts[event]>0 for event in events)
 
-                line=f.next()
+        return any(self.timed_counts[(time,event)]>0 for event in events)
 
-                if not(line[0]=='Parameter' or line[0][1]=='T'):
+    def next_time(self):
 
-                    p_trace=round(float(line[0]),2)
-                    p_app=round(float(line[1]),2)
+        '''Returns the earliest time that has events, or None if there are no events left'''
 
-                    Ndict[(p_trace,p_app)]+=1.0 # all dictionaries have value pairs as keys (prob of manual tracing, prob of app use)
-                    epidict[(p_trace,p_app)]+=float(line[2])
-                    qdict[(p_trace,p_app)]+=float(line[3])
-                    fpdict[(p_trace,p_app)]+=float(line[4])
+        if len(self.heap)>0:
 
-            except:
+            return self.heap[0][0]
 
-                break
+        return None
 
-    maxsize=epidict[(0.0,0.0)]
+    def pop_events(self,time):
 
-    for key in Ndict:
+        '''Generator over the (student_id,event_code) events at time; events added for time while iterating are included'''
 
-        redudict[key]=1.0-epidict[key]/maxsize
+        while len(self.heap)>0 and self.heap[0][0]==time:
 
-        epidict[key]/=(normalizer*Ndict[key])
-        qdict[key]/=(normalizer*Ndict[key])
-        fpdict[key]/=Ndict[key]
+            event=heappop(self.heap)
 
-    return epidict,redudict,qdict,fpdict
+            self.counts[event[3]]-=1
 
-# ---------------- RUNNING MULTIPLE RUNS
+            key=(time,event[3])
 
-def episizes_tracing_cluster(contactdict,student_ids,params,iterations=10):
+            self.timed_counts[key]-=1
 
-    '''Runs iterations run of the SEIR model with the CH data using parameters defined in params,
-    over the ranges of app probabilities and manual contact tracing probabilities defined below.
-    Developed for parallel runs using a cluster, so prints out all results so that they can be
-    piped into a file and read later (example reader code is above)'''
+            if self.timed_counts[key]==0:
 
-    app_probabilities=np.arange(0.0,1.1,0.1)
-    trace_hitrates=np.arange(0.0,1.1,0.1)
+                del self.timed_counts[key]
 
-    datalist=[]
-    qlist=[]
-    fplist=[]
+            yield event[2],event[3]
 
-    t1=time()
+        self.traced.pop(time,None)
 
-    # to speed up things, compute the time of the first event of each student and place in dictionary
+# ---------- CONTACT TRACE CLASS DEFINITION ----------------
 
-    first_times={}
+# usage: trace=ContactTrace(network,params['tracelength']) for each run; trace.record(...) marks which contacts of each
+# block of slots count for tracing (see advance_run), and trace.trace(student,curr_time) returns the contacts of student
+# within tracelength. The contacts of each student are found in the student index of the network (see students_between),
+# made once per network, and the trace only keeps one flag for each contact of the network that took place within tracelength:
+# the flags are in a ring buffer indexed by the position of the contact in the network (plus len(network) for each time the
+# data has been repeated), which grows when the contacts within tracelength do not fit in it.
+# Recording a block costs a slice assignment, and tracing a student costs about as much as the contacts of the student,
+# however many students there are. With rows, the trace has one row of flags for each replicate of a batch (see SEIR_batch_runs)
 
-    times=sorted(contactdict.keys())
+class ContactTrace(object):
 
-    for curr_time in times:
+    def __init__(self,network,tracelength,rows=1):
 
-        for contact in contactdict[curr_time]:
+        self.network=network
+        self.tracelength=tracelength
+        self.period=network.max_time+300 # the data is repeated with this period (see advance_run)
+        self.n_contacts=len(network)
 
-            node_i=contact[0]
-            node_j=contact[1]
+        self.flags=np.zeros((rows,1024),dtype=bool) # flags[row,position%size]: whether the contact at position was recorded
+        self.kept=deque()                            # (position,time) of the first contact of each recorded block within tracelength
+        self.end=0                                   # the position after the last recorded contact
 
-            if not(node_i in first_times):
+    def copy(self):
 
-                first_times[node_i]=curr_time
+        '''Returns a copy of the trace, with the same recorded contacts'''
 
-            if not(node_j in first_times):
+        trace=copy.copy(self)
 
-                first_times[node_j]=curr_time
+        trace.flags=self.flags.copy()
+        trace.kept=deque(self.kept)
 
-        if len(first_times)==len(student_ids):
+        return trace
 
-            break
+    def _write(self,rows,start,values):
 
-    for parameter in params:
+        '''Sets the flags of positions start..start+len(values)-1 (values has a column for each position)'''
 
-        print "Parameter\t"+parameter+"\t"+str(params[parameter])
+        size=self.flags.shape[1]
 
-    for pt in trace_hitrates:
+        first=start%size
+        n=min(values.shape[-1],size-first)
 
-        for ap in app_probabilities:
+        self.flags[rows,first:first+n]=values[...,:n]
+        self.flags[rows,:values.shape[-1]-n]=values[...,n:]
 
-            params['p_app']=ap
-            params['p_traced']=pt
+    def record(self,first_slot,end_slot,periodic_boundary_modifier,counted,contacts,rows=0):
 
-            Ilist=[]
-            qlist=[]
-            fplist=[]
+        '''Records which contacts of slots first_slot..end_slot-1 (+periodic_boundary_modifier) count for tracing:
+           counted[n] for the n:th contact returned by contacts.contacts_between(first_slot,end_slot) (contacts is the
+           network of the trace, or a view of it, see presence_view); a 2D counted has a row for each of rows'''
 
-            for i in xrange(0,iterations):
+        times=self.network.times
 
-                I,q,fp=SEIR_onerun_grid(contactdict,student_ids,first_times=first_times,params=params)
+        offset=(periodic_boundary_modifier//self.period)*self.n_contacts # of the positions in this repetition of the data
 
-                Ilist.append(I)
-                qlist.append(q)
-                fplist.append(fp)
+        start,end,positions=contacts.contact_positions(first_slot,end_slot)
 
-            for i in xrange(0,len(Ilist)):
+        # contacts older than tracelength before the last one of the block can no longer be traced
 
-                I=Ilist[i]
-                q=qlist[i]
-                fp=fplist[i]
+        last_time=int(times[end_slot-1])+periodic_boundary_modifier
 
-                print str(pt)+"\t"+str(ap)+"\t"+str(I)+"\t"+str(q)+"\t"+str(fp)
+        kept_slot=max(first_slot,np.searchsorted(times,last_time-self.tracelength-periodic_boundary_modifier))
+        kept_start=self.network.contact_positions(kept_slot,end_slot)[0]
 
-    print "Time: "+str((time()-t1)/60.0)+" min"
+        self.kept.append((offset+kept_start,int(times[kept_slot])+periodic_boundary_modifier))
 
-def SEIR_onerun_grid(contactdict,student_ids,params=default_intervention_params,first_times={},p_transmission=0.00625,initial_period_in_days=7,I_only=False,chain=False,dailynets=False,nets_per_day=8,animate=False,curr_layout=[],R0=False):
+        while len(self.kept)>1 and self.kept[1][1]<=last_time-self.tracelength:
 
-    '''Does one run of the SEIR model, returning various items depending on user choice (see end of function).
-       Required inputs:
-                contactdict: dictionary[time]=[contact1,contact2,contact2] where contact=(student_id1,student_id2)
-                student_ids: set of all student ids in contactdict
-       User choices:
-                first_times: dictionary[student_id]=timestamp of student_id's first contact (speeds up runs if precomputed)
-                p_transmission: probability of transmission from I to S in one timestep, default p=0.004
-                initial_period_in_days: determines infection time of first patient (first contact time + randomly drawn time from initial_period_in_days)
-                I_only: if True, the run only returns the final number of infected 
-                chain: if True, the run also returns the transmission chain as an event list [(source1,target1,time1),(source2,...]
-                dailynets: if True, the run also returns for each period a pynet.SymmNet() network + dictionaries of student states + transmission list
-                nets_per_day: (default=8) how many nets to return per day in dailynets and how many frames per day for animations
-                animate: if True, the run only returns a list of frames to be animated with moviepy.editor.ImageSequenceClip()
-                curr_layout=[]: only used for animation, if one wants to start from a pre-determined node layout
-        Outputs:
-                depend on the above choices. See end of function'''
+            self.kept.popleft()
+
+        needed=offset+end-self.kept[0][0]
+
+        if needed>self.flags.shape[1]: # make room for the contacts within tracelength, keeping those recorded already
+
+            first=self.kept[0][0]
+
+            recorded=np.take(self.flags,np.arange(first,self.end)%self.flags.shape[1],axis=1)
+
+            self.flags=np.zeros((self.flags.shape[0],1<<int(needed).bit_length()),dtype=bool)
+
+            self._write(slice(None),first,recorded)
+
+        if positions is None: # all contacts of the slots
+
+            self._write(rows,offset+kept_start,counted[...,kept_start-start:])
+
+        else: # only those of the view, the others did not take place
+
+            kept=np.searchsorted(positions,kept_start)
+
+            flags=np.zeros(counted.shape[:-1]+(end-kept_start,),dtype=bool)
+            flags[...,positions[kept:]-kept_start]=counted[...,kept:]
+
+            self._write(rows,offset+kept_start,flags)
+
+        self.end=offset+end
+
+    def trace(self,student,curr_time,row=0):
+
+        '''Returns the contacts of student within tracelength before curr_time as a Counter: contacts[student_id]=number of
+           time slots together (counted in time order); and the number of contacts of the student in the network within
+           tracelength, which were scanned to find them'''
+
+        first=curr_time-self.tracelength
+
+        times=self.network.times
+        period=self.period
+
+        partners=[]
+        scanned=0
+
+        if len(self.kept)==0: # nothing recorded
+
+            return Counter(),scanned
+
+        kept_start=self.kept[0][0] # contacts before it were not recorded in this run, or can no longer be traced
+
+        for repetition in xrange(max(0,first//period),(curr_time-1)//period+1): # the data times of the window in each repetition of the data
+
+            first_slot=np.searchsorted(times,first-repetition*period)
+            end_slot=np.searchsorted(times,curr_time-repetition*period)
+
+            if end_slot==first_slot:
+
+                continue
+
+            for block_first_slot,offsets,base,starts,entries,node_i,node_j in self.network.students_between(first_slot,end_slot):
+
+                # the entries of student are 2*position+side (0 if student is node_i, 1 if node_j) of its contacts, in order
+
+                own=entries[starts[student]:starts[student+1]]
+
+                lo=2*offsets[max(first_slot-block_first_slot,0)]
+                hi=2*offsets[min(end_slot-block_first_slot,len(offsets)-1)]
+
+                own=own[np.searchsorted(own,lo):np.searchsorted(own,hi)]
+
+                scanned+=len(own)
+
+                positions=own>>1
+                sides=own&1
+
+                positions_in_trace=repetition*self.n_contacts+base+positions
+
+                recorded=(positions_in_trace>=kept_start)&(positions_in_trace<self.end)
+
+                recorded[recorded]=self.flags[row,positions_in_trace[recorded]%self.flags.shape[1]]
+
+                positions=positions[recorded]
+                sides=sides[recorded]
+
+                # in time order, and in each slot the contacts where student is node_i first (as a Node's trace had them)
+
+                order=np.lexsort((sides,np.searchsorted(offsets,positions,side='right')))
+
+                positions=positions[order]
+                sides=sides[order]
+
+                partners.extend(np.where(sides==0,node_j[positions],node_i[positions]).tolist())
+
+        return Counter(partners),scanned
+
+# ---------- CONTACT NETWORK CLASS DEFINITION ----------------
+
+# usage: build once (read_contacts returns one) and pass to all runs
+# contacts are stored in CSR form: the contacts at time times[k] are
+# node_i[offsets[k]:offsets[k+1]] and node_j[offsets[k]:offsets[k+1]]
+# students are remapped to dense indices 0..N_students-1; ids[index] gives the original id
+
+def _student_index(node_i,node_j,N_students): # (starts,entries) of ContactNetwork.students_between for contacts node_i,node_j
+
+    # the entries of both sides of each contact, 2*position+side, grouped by student: sorted as student*n+entry (all different)
+
+    n=2*len(node_i)
 
-    student_id_list=list(student_ids) # list of ids in data; not all ids appear at all
+    keys=np.column_stack((node_i,node_j)).ravel().astype(np.int64)*n+np.arange(n)
 
-    N_students=len(student_id_list)
+    keys.sort()
 
-    max_time=max(contactdict.keys())
+    starts=np.searchsorted(keys,np.arange(N_students+1,dtype=np.int64)*n)
 
-    patient_zero_index=choice(student_id_list)
+    return starts,(keys%n).astype(np.int32 if n<2**31 else np.int64)
 
-    # initialize all students
-    # so that studentlist[i] = class Node in S state
+class ContactNetwork(object):
 
-    studentlist={}
-    students_with_apps=set()
+    def __init__(self,timestamps,node_i,node_j):
 
-    for sid in student_id_list:
+        '''Builds the network from three equally long sequences (timestamp,node_i,node_j) of contact events'''
 
-        studentlist[sid]=Node(params=params,myid=sid,currtime=0)
-        if studentlist[sid].has_app:
+        timestamps=np.asarray(timestamps,dtype=np.int64)
+        node_i=np.asarray(node_i,dtype=np.int64)
+        node_j=np.asarray(node_j,dtype=np.int64)
 
-            students_with_apps.add(sid)
+        order=np.argsort(timestamps,kind='mergesort') # stable, so contacts keep their order within a time slot
 
-        for sid2 in student_id_list:
+        timestamps=timestamps[order]
 
-            studentlist[sid].contacts[sid2]=deque() # queue with fast left pop
+        self.ids,dense=np.unique(np.concatenate((node_i[order],node_j[order])),return_inverse=True) # dense id remapping
 
-    if len(first_times)==0:
+        self.node_i=dense[:len(order)].astype(np.int32)
+        self.node_j=dense[len(order):].astype(np.int32)
 
-        first_times={}
+        self.times,starts=np.unique(timestamps,return_index=True) # times with at least one contact
+        self.offsets=np.append(starts,len(timestamps)).astype(np.int64)
 
-        times=sorted(contactdict.keys())
+        # time of the first contact of each student (speeds up choosing the starting time of a run)
 
-        for curr_time in times:
+        first_times=np.full(len(self.ids),np.iinfo(np.int64).max,dtype=np.int64)
+
+        np.minimum.at(first_times,self.node_i,timestamps)
+        np.minimum.at(first_times,self.node_j,timestamps)
+
+        self.first_times=first_times
+
+        self._set_derived()
+
+    array_names=('times','offsets','node_i','node_j','ids','first_times') # the arrays that define the network
+
+    def _set_derived(self):
+
+        self.N_students=len(self.ids)
+        self.index=dict((sid,i) for i,sid in enumerate(self.ids.tolist())) # original id -> dense index
+
+        self.max_time=int(self.times[-1]) if len(self.times)>0 else 0
+
+        self.presence_views={} # see presence_view
+        self.student_contacts=None # see student_contacts
+        self.student_index=None # see students_between
+
+        self.positions=None # for a view made by present_contacts, the positions of its contacts in the network it was made from
+
+    def save(self,dirname):
+
+        '''Writes the arrays of the network as .npy files into directory dirname'''
+
+        if not os.path.isdir(dirname):
+
+            os.makedirs(dirname)
+
+        for name in self.array_names:
+
+            np.save(os.path.join(dirname,name+'.npy'),getattr(self,name))
+
+    @classmethod
+    def load(cls,dirname,mmap_mode='r'):
+
+        '''Loads a network written by save; by default the arrays are memory-mapped, not read into memory'''
+
+        network=cls.__new__(cls)
+
+        for name in cls.array_names:
+
+            setattr(network,name,np.asarray(np.load(os.path.join(dirname,name+'.npy'),mmap_mode=mmap_mode))) # plain ndarray view, still backed by the file
+
+        network._set_derived()
+
+        return network
+
+    @classmethod
+    def from_dict(cls,contactdict,student_ids=None):
+
+        '''Builds the network from the old dict[timestamp]=[(node_i,node_j),...] representation.
+           student_ids is accepted for compatibility; only students with contacts are included.'''
+
+        timestamps=[]
+        node_i=[]
+        node_j=[]
+
+        for curr_time in sorted(contactdict):
 
             for contact in contactdict[curr_time]:
 
-                node_i=contact[0]
-                node_j=contact[1]
-    
-                if not(node_i in first_times):
-    
-                    first_times[node_i]=curr_time
+                timestamps.append(curr_time)
+                node_i.append(contact[0])
+                node_j.append(contact[1])
 
-                if not(node_j in first_times):
+        return cls(timestamps,node_i,node_j)
 
-                    first_times[node_j]=curr_time
+    def __len__(self):
 
-            if len(first_times)==len(studentlist):
+        return len(self.node_i)
 
-                break
+    def edges(self,k):
 
-    # initialize event queue
+        '''Returns the (node_i,node_j) arrays of dense indices for time slot k'''
 
-    eventq=defaultdict(list) # dictionary dict[timestamp]={(student_id,state),...] of state changes
+        return self.node_i[self.offsets[k]:self.offsets[k+1]],self.node_j[self.offsets[k]:self.offsets[k+1]]
 
-    # find first event where patient zero participates; start from there.
+    def contacts_between(self,first_slot,end_slot):
 
-    curr_time=first_times[patient_zero_index] # pick first event of patient zero as starting time
+        '''Returns (node_i,node_j,offsets,end_slot) for the contacts of slots first_slot..end_slot-1;
+           the contacts of slot k start at position offsets[k-first_slot] of node_i and node_j'''
 
-    curr_time=curr_time+int(timestep_in_data*round((day*random()*initial_period_in_days)/timestep_in_data)) # add 0-7 days at random
+        start=self.offsets[first_slot]
+        end=self.offsets[end_slot]
 
-    studentlist[patient_zero_index].exposure(eventq,curr_time,params) # now expose patient zero
+        return self.node_i[start:end],self.node_j[start:end],self.offsets[first_slot:end_slot+1]-start,end_slot
 
-    exposed=1
-    infectious=0
-    total_infected=1
-        
-    done=False
-    quarantines=0
-    false_quarantines=0
+    def contact_positions(self,first_slot,end_slot):
 
-    periodic_boundary_modifier=0
+        '''Returns (start,end,positions): the contacts of slots first_slot..end_slot-1 are at positions start..end-1 of the network
+           (or, for a view made by present_contacts, of the network it was made from); positions are those of the contacts
+           returned by contacts_between(first_slot,end_slot), or None if they are all of them'''
 
-    while not (done):
+        if self.positions is None:
 
-        # --------- handle event queue
+            return self.offsets[first_slot],self.offsets[end_slot],None
 
-        if curr_time in eventq:
+        return self.base_offsets[first_slot],self.base_offsets[end_slot],self.positions[self.offsets[first_slot]:self.offsets[end_slot]]
 
-            for event in eventq[curr_time]: # eventq events: (student_id,new_state)
+    def students_between(self,first_slot,end_slot):
 
-                if event[1]=='BOQ_t' and not(studentlist[event[0]].in_quarantine):
+        '''Returns the student index of the contacts of slots first_slot..end_slot-1 as a list of
+           (first_slot,offsets,start,starts,entries,node_i,node_j): for the contacts of the network at positions start+p,
+           where the contacts of slot first_slot+k start at p=offsets[k] in node_i and node_j, entries[starts[s]:starts[s+1]]
+           are 2*p+side in order, for each contact of student s (side 0 if s is node_i, 1 if node_j).
+           Made once for the whole network and kept in it'''
 
-                    quarantines+=1
+        if self.student_index is None:
 
-                    if studentlist[event[0]].state=='S' or studentlist[event[0]].state=='R':
+            self.student_index=_student_index(self.node_i,self.node_j,self.N_students)
 
-                        false_quarantines+=1
+        return [(0,self.offsets,0)+self.student_index+(self.node_i,self.node_j)]
 
-                elif event[1]=='R': # book-keeping for the various classes (S=susceptible,E=exposed,Ip=presymptomatic infectious,I=infectious, Ic=cumulative number of infected, R=recovered)
+    def contacts_at(self,curr_time):
 
-                    infectious-=1
+        '''Returns the (node_i,node_j) arrays for timestamp curr_time, or None if there are no contacts then'''
 
-                elif event[1][0]=='I':
+        k=np.searchsorted(self.times,curr_time)
 
-                    exposed-=1
-                    infectious+=1
+        if k==len(self.times) or self.times[k]!=curr_time:
 
-                studentlist[event[0]].statechange(eventq,event[1],curr_time,params,students_with_apps) # change student's state (disease progression, quarantine)
+            return None
 
-            del eventq[curr_time]
+        return self.edges(k)
 
-        # --------- handle transmission and contacts
+    def present_contacts(self,present):
 
-        if (curr_time-periodic_boundary_modifier)>max_time:
+        '''Returns a ContactNetwork with the same time slots and students, with only the contacts between
+           students that are both present (present[student] True)'''
 
-            periodic_boundary_modifier+=max_time+300
+        keep=present[self.node_i]&present[self.node_j]
 
-        if (curr_time-periodic_boundary_modifier) in contactdict: # if there are contacts at time t=curr_time
+        network=ContactNetwork.__new__(ContactNetwork)
 
-            for contact in contactdict[(curr_time-periodic_boundary_modifier)]: # loop through all contacts that take place at t=curr_time
+        network.times=self.times
+        network.offsets=np.concatenate(([0],np.cumsum(keep)))[self.offsets]
+        network.node_i=self.node_i[keep]
+        network.node_j=self.node_j[keep]
+        network.ids=self.ids
+        network.first_times=self.first_times
 
-                if not(studentlist[contact[0]].state=='S' and studentlist[contact[1]].state=='S') and not(studentlist[contact[0]].in_quarantine or studentlist[contact[1]].in_quarantine): # note: works only for this particular SEIR timeline (incubation time etc)
+        network._set_derived()
 
-                    studentlist[contact[0]].contacts[contact[1]].append(curr_time)
-                    studentlist[contact[1]].contacts[contact[0]].append(curr_time)
+        network.positions=np.flatnonzero(keep) # the positions of its contacts in self (see contact_positions)
+        network.base_offsets=self.offsets
 
-                    if (studentlist[contact[0]].infectious and studentlist[contact[1]].state=='S') or (studentlist[contact[1]].infectious and studentlist[contact[0]].state=='S'):
+        return network
 
-                        if studentlist[contact[1]].state=='S':
+# usage: build the shards once with ingest_contacts, then ShardedContactNetwork(sharddir) can be passed to all runs
+# instead of a ContactNetwork; only the slot times and per-student data are kept in memory,
+# the contacts of one time window (shard) at a time are loaded when the run gets there
 
-                            source=contact[0]
-                            target=contact[1]
+shard_index_cache_size=4 # student indices of this many shards are kept in a ShardedContactNetwork (see students_between)
 
-                        else:
+class ShardedContactNetwork(object):
 
-                            source=contact[1]
-                            target=contact[0]
+    def __init__(self,sharddir):
 
-                        if random()<p_transmission*studentlist[source].dampingfactor:# *studentlist[source].mask_factor_out*studentlist[target].mask_factor_in: # source infects target with this probability
+        self.sharddir=sharddir
 
-                            studentlist[target].exposure(eventq,curr_time,params) # expose the target and recompute event queue to add disease progression events for target
+        for name in ('times','ids','first_times','shard_numbers','shard_first_slot'):
 
-                            exposed+=1
-                            total_infected+=1
-                
-            if (exposed+infectious)==0: # simulation done when no-one is infectious or exposed
+            setattr(self,name,np.load(os.path.join(sharddir,name+'.npy')))
 
-                done=True
+        self.N_students=len(self.ids)
+        self.index=dict((sid,i) for i,sid in enumerate(self.ids.tolist())) # original id -> dense index
 
-            curr_time+=int(timestep_in_data)
+        self.max_time=int(self.times[-1]) if len(self.times)>0 else 0
 
+        self.presence_views={} # see presence_view
+        self.shard_indices={} # see students_between
 
-        # -------------- done looping over contacts at time curr_time
+        # the position of the first contact of each shard, as if the shards were one network
 
-#    print time()-t1
+        self.shard_starts=np.cumsum([0]+[len(np.load(os.path.join(sharddir,'shard_%d.npy' % number),mmap_mode='r')) for number in self.shard_numbers])
 
-    if quarantines>0:
+        self.shard=None # number (position in shard_numbers) of the shard in memory
 
-        fq=float(false_quarantines)/quarantines
+    def __len__(self):
 
-    else:
+        return int(np.load(os.path.join(self.sharddir,'n_contacts.npy')))
 
-        fq=0.0
+    def _load_shard(self,shard):
 
-    return total_infected,quarantines,fq # only return the final total number of infected + ppl in quarantine + false positive ratios
+        '''Loads shard (position in shard_numbers) into memory, replacing the previous one'''
 
-if __name__=="__main__":
+        contacts=np.load(os.path.join(self.sharddir,'shard_%d.npy' % self.shard_numbers[shard]))
+
+        first_slot=self.shard_first_slot[shard]
+        end_slot=self.shard_first_slot[shard+1] if shard+1<len(self.shard_numbers) else len(self.times)
+
+        self.shard=shard
+        self.shard_slots=(first_slot,end_slot)
+        self.shard_offsets=np.append(np.searchsorted(contacts['time'],self.times[first_slot:end_slot]),len(contacts)).astype(np.int64)
+        self.shard_node_i=np.searchsorted(self.ids,contacts['node_i']).astype(np.int32) # original id -> dense index
+        self.shard_node_j=np.searchsorted(self.ids,contacts['node_j']).astype(np.int32)
+
+    def contacts_between(self,first_slot,end_slot):
+
+        '''Returns (node_i,node_j,offsets,end_slot) for the contacts of slots first_slot..end_slot-1 (see ContactNetwork);
+           stops at the end of the shard of first_slot, so end_slot may be smaller than asked for'''
+
+        shard=np.searchsorted(self.shard_first_slot,first_slot,side='right')-1
+
+        if shard!=self.shard:
+
+            self._load_shard(shard)
+
+        end_slot=min(end_slot,self.shard_slots[1])
+
+        offsets=self.shard_offsets[first_slot-self.shard_slots[0]:end_slot-self.shard_slots[0]+1]
+
+        return self.shard_node_i[offsets[0]:offsets[-1]],self.shard_node_j[offsets[0]:offsets[-1]],offsets-offsets[0],end_slot
+
+    def contact_positions(self,first_slot,end_slot):
+
+        '''Returns (start,end,None) for the contacts of slots first_slot..end_slot-1 (see ContactNetwork), in the shard
+           that contacts_between(first_slot,end_slot) has loaded'''
+
+        start=self.shard_starts[self.shard]
+
+        return start+self.shard_offsets[first_slot-self.shard_slots[0]],start+self.shard_offsets[end_slot-self.shard_slots[0]],None
+
+    def students_between(self,first_slot,end_slot):
+
+        '''Returns the student index of the contacts of slots first_slot..end_slot-1 (see ContactNetwork), one item for each shard
+           of these slots; the index of a shard is made when it is first needed, and those of the last few shards are kept'''
+
+        index=[]
+
+        first_shard=np.searchsorted(self.shard_first_slot,first_slot,side='right')-1
+        end_shard=np.searchsorted(self.shard_first_slot,end_slot,side='left')
+
+        for shard in xrange(first_shard,end_shard):
+
+            if not(shard in self.shard_indices):
+
+                if len(self.shard_indices)>=shard_index_cache_size:
+
+                    self.shard_indices.clear()
+
+                if shard!=self.shard:
+
+                    self._load_shard(shard)
+
+                self.shard_indices[shard]=(self.shard_slots[0],self.shard_offsets,self.shard_starts[shard])+_student_index(self.shard_node_i,self.shard_node_j,self.N_students)+(self.shard_node_i,self.shard_node_j)
+
+            index.append(self.shard_indices[shard])
+
+        return index
+
+    def edges(self,k):
+
+        '''Returns the (node_i,node_j) arrays of dense indices for time slot k'''
+
+        return self.contacts_between(k,k+1)[:2]
+
+# with the interleaving intervention (oddweeks) only half of the students are on campus in a week, so only
+# the contacts between students that are both present can take place. A run takes its contacts from a view of the network
+# with only those, one for the students present on even weeks and one for odd weeks, instead of checking every contact.
+# The views are cached in the network for each assignment of students to weeks (a bitmask of the present students),
+# as the runs of an iteration share the assignment with common random numbers (and forked runs always do)
+
+presence_cache_size=8 # views of this many assignments are kept in each network
+
+class PresentContacts(object):
+
+    def __init__(self,network,present):
+
+        '''The contacts of network between students that are both present (present[student] True), filtered
+           when they are asked for; contacts_between as for the network'''
+
+        self.network=network
+        self.present=present
+
+    def contacts_between(self,first_slot,end_slot):
+
+        ei,ej,offsets,end_slot=self.network.contacts_between(first_slot,end_slot)
+
+        keep=self.present[ei]&self.present[ej]
+
+        return ei[keep],ej[keep],np.concatenate(([0],np.cumsum(keep)))[offsets],end_slot
+
+    def contact_positions(self,first_slot,end_slot):
+
+        ei,ej,offsets,end_slot=self.network.contacts_between(first_slot,end_slot)
+
+        start,end,positions=self.network.contact_positions(first_slot,end_slot)
+
+        return start,end,start+np.flatnonzero(self.present[ei]&self.present[ej])
+
+def presence_view(network,present):
+
+    '''Returns the contacts of network between students that are both present (present[student] True), as an object
+       with contacts_between like the network. The first time an assignment is seen the contacts are filtered as they
+       are asked for (PresentContacts); if it is seen again, a filtered ContactNetwork is made and cached'''
+
+    key=np.packbits(present).tobytes()
+
+    views=network.presence_views
+
+    if key in views:
+
+        if views[key] is None and isinstance(network,ContactNetwork):
+
+            views[key]=network.present_contacts(present)
+
+        if views[key] is not None:
+
+            return views[key]
+
+    else:
+
+        if len(views)>=presence_cache_size:
+
+            views.clear()
+
+        views[key]=None
+
+    return PresentContacts(network,present)
+
+def as_network(contacts,student_ids=None):
+
+    '''Returns contacts as a ContactNetwork; converts an old-style contact dict if needed'''
+
+    if hasattr(contacts,'contacts_between'): # ContactNetwork or ShardedContactNetwork
+
+        return contacts
+
+    return ContactNetwork.from_dict(contacts,student_ids)
+ 
+# --------------- AUX FUNCTIONS ----------------
+
+cache_version=1 # increase when the cache format changes, so that old caches are rebuilt
+
+def read_contacts(filename=inputfile,cache=True,min_rssi=None): # reads the contact event list into a ContactNetwork
+
+    '''Returns a ContactNetwork of all contact events (see class ContactNetwork above);
+       network.ids holds the student id's encountered in all events.
+       With cache=True the network is also written as a binary cache next to the csv file (directory filename+'.cache');
+       later calls memory-map the cache instead of parsing the csv. The cache is rebuilt if the csv file's
+       modification time or size changes.
+       min_rssi: if given, only contacts with signalstrength>=min_rssi are included (cached separately for each min_rssi).'''
+
+    filename=path+filename
+
+    if min_rssi is None:
+
+        cachedir=filename+'.cache'
+
+    else:
+
+        cachedir=filename+'.rssi'+str(min_rssi)+'.cache'
+
+    if cache:
+
+        stat=os.stat(filename)
+        source=np.array([stat.st_mtime,stat.st_size,cache_version],dtype=float) # identifies the csv file the cache was built from
+
+        try:
+
+            if np.array_equal(np.load(os.path.join(cachedir,'source.npy')),source):
+
+                return ContactNetwork.load(cachedir)
+
+        except (IOError,OSError,ValueError): # no cache yet, or a broken one
+
+            pass
+
+    timestamps,nodes_i,nodes_j,signalstrengths=read_contacts_csv(filename,min_rssi=min_rssi)
+
+    network=ContactNetwork(timestamps,nodes_i,nodes_j)
+
+    if cache:
+
+        # write into a temporary directory first, so that concurrent jobs never see a half-written cache
+
+        tmpdir=cachedir+'.tmp'+str(os.getpid())
+
+        try:
+
+            network.save(tmpdir)
+            np.save(os.path.join(tmpdir,'source.npy'),source)
+
+            if os.path.isdir(cachedir):
+
+                shutil.rmtree(cachedir,ignore_errors=True)
+
+            os.rename(tmpdir,cachedir)
+
+        except (IOError,OSError): # e.g. no write permission, or another job just wrote the cache; run without it
+
+            shutil.rmtree(tmpdir,ignore_errors=True)
+
+    return network
+
+def read_contacts_csv(filename,min_rssi=None):
+
+    '''Parses a contact csv file (header line, then timestamp,node_i,node_j,signalstrength);
+       returns arrays of timestamps, node_i, node_j and signal strengths of the contacts with node_j>=0
+       (and signalstrength>=min_rssi if given)'''
+
+    chunks=list(read_contacts_chunks(filename,min_rssi=min_rssi))
+
+    if len(chunks)==0:
+
+        return tuple(np.zeros(0,dtype=np.int64) for column in xrange(0,4))
+
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+def read_contacts_chunks(filename,chunk_rows=1000000,min_rssi=None):
+
+    '''Generator over a contact csv file in chunks of at most chunk_rows lines;
+       yields arrays (timestamps,node_i,node_j,signalstrengths) of the contacts in each chunk that pass the filters'''
+
+    with open(filename,'rU') as fn:
+
+        f=csv.reader(fn,delimiter=',')
+
+        next(f) # skip header line
+
+        while True:
+
+            chunk=[]
+
+            for line in f:
+
+                if len(line)==0: # skip empty lines
+
+                    continue
+
+                try:
+
+                    chunk.append((int(line[0]),int(line[1]),int(line[2]),int(line[3]))) # timestamp,node_i,node_j,signalstrength
+
+                except (ValueError,IndexError):
+
+                    raise ValueError('%s, line %d: cannot parse contact %s' % (filename,f.line_num,line))
+
+                if len(chunk)==chunk_rows:
+
+                    break
+
+            if len(chunk)==0:
+
+                return
+
+            chunk=np.array(chunk,dtype=np.int64)
+
+            keep=chunk[:,2]>=0 # node_j<0: no contact in this scan
+
+            # add any filter rules here if req'd
+
+            if min_rssi is not None:
+
+                keep&=chunk[:,3]>=min_rssi
+
+            chunk=chunk[keep]
+
+            yield chunk[:,0],chunk[:,1],chunk[:,2],chunk[:,3]
+
+shard_dtype=np.dtype([('time',np.int64),('node_i',np.int32),('node_j',np.int32)]) # one contact in a shard file
+
+def ingest_contacts(filename,sharddir,shard_length=day,chunk_rows=1000000,min_rssi=None):
+
+    '''Streams a contact csv file (see read_contacts_csv) that may be too large for memory into time-partitioned
+       shards in directory sharddir, one file per shard_length seconds; open the result with ShardedContactNetwork(sharddir).
+       The file is read chunk_rows lines at a time, so peak memory is about one shard plus one chunk.
+       The file must be sorted by time at least at shard resolution (rows of a shard must not come after rows of a later shard).'''
+
+    if not os.path.isdir(sharddir):
+
+        os.makedirs(sharddir)
+
+    first_times={} # original id -> time of first contact
+    times=[]
+    shard_numbers=[]
+    shard_first_slot=[]
+    n_contacts=0
+
+    pending=np.zeros(0,dtype=shard_dtype) # contacts of shards not yet written
+    open_shard=None # shards before this one are written and may not get new contacts
+
+    def write_shard(contacts,n_slots):
+
+        contacts=contacts[np.argsort(contacts['time'],kind='mergesort')] # stable, keeps the order within a slot
+
+        shard_times=np.unique(contacts['time'])
+
+        shard_numbers.append(int(contacts['time'][0]//shard_length))
+        shard_first_slot.append(n_slots)
+        times.append(shard_times)
+
+        np.save(os.path.join(sharddir,'shard_%d.npy' % shard_numbers[-1]),contacts)
+
+        return n_slots+len(shard_times)
+
+    n_slots=0
+
+    for timestamps,node_i,node_j,signalstrengths in read_contacts_chunks(filename,chunk_rows=chunk_rows,min_rssi=min_rssi):
+
+        if len(timestamps)==0:
+
+            continue
+
+        shards=timestamps//shard_length
+
+        if open_shard is not None and shards.min()<open_shard:
+
+            raise ValueError('%s is not sorted by time: contacts at time %d come after shard %d was written' % (filename,timestamps[shards<open_shard][0],open_shard-1))
+
+        chunk=np.empty(len(timestamps),dtype=shard_dtype)
+        chunk['time']=timestamps
+        chunk['node_i']=node_i
+        chunk['node_j']=node_j
+
+        n_contacts+=len(chunk)
+
+        # first contact times of the students in this chunk
+
+        for nodes in (node_i,node_j):
+
+            order=np.lexsort((timestamps,nodes))
+            nodes_sorted=nodes[order]
+            firsts=np.flatnonzero(np.r_[True,nodes_sorted[1:]!=nodes_sorted[:-1]])
+
+            for sid,first_time in zip(nodes_sorted[firsts].tolist(),timestamps[order][firsts].tolist()):
+
+                if first_time<first_times.get(sid,first_time+1):
+
+                    first_times[sid]=first_time
+
+        # all shards before the last one seen in this chunk are complete
+
+        pending=np.concatenate((pending,chunk))
+        pending_shards=pending['time']//shard_length
+
+        open_shard=int(shards.max())
+
+        for shard in np.unique(pending_shards[pending_shards<open_shard]):
+
+            n_slots=write_shard(pending[pending_shards==shard],n_slots)
+
+        pending=pending[pending_shards>=open_shard]
+
+    if len(pending)>0:
+
+        n_slots=write_shard(pending,n_slots)
+
+    ids=np.array(sorted(first_times),dtype=np.int64)
+
+    np.save(os.path.join(sharddir,'ids.npy'),ids)
+    np.save(os.path.join(sharddir,'first_times.npy'),np.array([first_times[sid] for sid in ids.tolist()],dtype=np.int64))
+    np.save(os.path.join(sharddir,'times.npy'),np.concatenate(times) if len(times)>0 else np.zeros(0,dtype=np.int64))
+    np.save(os.path.join(sharddir,'shard_numbers.npy'),np.array(shard_numbers,dtype=np.int64))
+    np.save(os.path.join(sharddir,'shard_first_slot.npy'),np.array(shard_first_slot,dtype=np.int64))
+    np.save(os.path.join(sharddir,'n_contacts.npy'),np.array(n_contacts,dtype=np.int64))
+
+# ---------- RESULT FILES ----------------
+
+# results of a sweep are written in columns (one array per quantity, one row per run) into .npz part files
+# in a results directory; each part is a batch of runs and also stores the parameters and grid of the sweep as metadata.
+# Columns: the values of the swept parameters (see sweep_grid), p_traced and p_app (also when they are not swept),
+# seed (the seed of each run: base_seed, the index of the value of each swept parameter, iteration), iteration,
+# and the results total_infected, quarantines and fq.
+# Parts are named part_<base_seed>_<shard>_<n>.npz, so that several jobs can write into the same directory.
+
+result_names=['total_infected','quarantines','fq']
+
+def write_results(results_dir,columns,metadata,base_seed,shard,part):
+
+    '''Writes columns (dictionary of lists, one value per run) as part number part of shard shard of a sweep with base_seed,
+       with metadata (a dictionary); the file is written under a temporary name and renamed, so that a part is either complete or missing'''
+
+    if not os.path.isdir(results_dir):
+
+        try:
+
+            os.makedirs(results_dir)
+
+        except OSError: # made by another job in the meantime
+
+            pass
+
+    arrays={}
+
+    for name in columns:
+
+        arrays[name]=np.array(columns[name])
+
+    arrays['metadata']=np.array(json.dumps(metadata,sort_keys=True))
+
+    filename=os.path.join(results_dir,'part_%d_%d_%05d.npz' % (base_seed,shard,part))
+
+    with open(filename+'.tmp','wb') as f:
+
+        np.savez(f,**arrays)
+
+    os.rename(filename+'.tmp',filename)
+
+def result_parts(results_dir,base_seed=None,shard=None):
+
+    '''Returns the names of the part files in results_dir (of the sweep with base_seed, and of its shard)'''
+
+    prefix='part_'
+
+    if base_seed is not None:
+
+        prefix+='%d_' % base_seed
+
+        if shard is not None:
+
+            prefix+='%d_' % shard
+
+    return sorted(filename for filename in os.listdir(results_dir) if filename.startswith(prefix) and filename.endswith('.npz'))
+
+def read_results(results_dir,base_seed=None):
+
+    '''Returns the results of all parts in results_dir (or only those of the sweep with base_seed) as a dictionary
+       of columns (those found in all parts), and a list of the metadata of each sweep found'''
+
+    columns=defaultdict(list)
+    metadatalist=[]
+
+    for filename in result_parts(results_dir,base_seed):
+
+        with np.load(os.path.join(results_dir,filename)) as part:
+
+            for name in part.files:
+
+                if not(name=='metadata'):
+
+                    columns[name].append(part[name])
+
+            metadata=json.loads(str(part['metadata']))
+
+        if not(metadata in metadatalist):
+
+            metadatalist.append(metadata)
+
+    N_parts=max([len(column) for column in columns.values()]+[0])
+
+    results={}
+
+    for name in columns:
+
+        if len(columns[name])==N_parts:
+
+            results[name]=np.concatenate(columns[name])
+
+    for name in ['p_traced','p_app']+result_names:
+
+        if not(name in results):
+
+            results[name]=np.zeros(0)
+
+    return results,metadatalist
+
+def group_results(results,keys,names=result_names):
+
+    '''Groups runs by the values of keys (columns of results); returns the points (list of tuples of values of keys),
+       the number of runs at each point, and dictionaries name:array of the mean and the variance of each column in names at each point'''
+
+    N_runs=len(results[names[0]])
+
+    codes=np.zeros(N_runs,dtype=np.int64)
+
+    for key in keys: # one integer code for each combination of values
+
+        values,inverse=np.unique(results[key],return_inverse=True)
+
+        codes=codes*len(values)+inverse
+
+    codes,first,group=np.unique(codes,return_index=True,return_inverse=True)
+
+    points=zip(*[results[key][first].tolist() for key in keys])
+
+    N=np.bincount(group,minlength=len(codes)).astype(float)
+
+    means={}
+    variances={}
+
+    for name in names:
+
+        values=np.asarray(results[name],dtype=float)
+
+        means[name]=np.bincount(group,weights=values,minlength=len(codes))/N
+        variances[name]=np.bincount(group,weights=values**2,minlength=len(codes))/N-means[name]**2
+
+    return points,N,means,variances
+
+def aggregate_results(results,keys=['p_traced','p_app'],normalizer=692.0):
+
+    '''Averages the results of runs (columns as returned by read_results) over each point of the grid of keys;
+       returns the dictionaries of read_cluster, with the tuples of the values of keys as keys. The epidemic reduction
+       of a point is relative to the point with the same values except p_traced=p_app=0.0 (no tracing), if it was run'''
+
+    results=dict(results)
+
+    for key in ['p_traced','p_app']:
+
+        results[key]=np.round(np.asarray(results[key],dtype=float),2)
+
+    points,N,means,variances=group_results(results,keys)
+
+    epi=dict(zip(points,means['total_infected']))
+
+    epidict=defaultdict(float) # epidemic sizes
+    redudict=defaultdict(float) # epidemic reduction
+    qdict=defaultdict(float) # fraction in quarantine
+    fpdict=defaultdict(float) # fraction non-infected in quarantine
+
+    for n,point in enumerate(points): # all dictionaries have points as keys, e.g. (prob of manual tracing, prob of app use)
+
+        baseline=tuple(0.0 if key in ['p_traced','p_app'] else value for key,value in zip(keys,point))
+
+        redudict[point]=1.0-epi[point]/epi[baseline] if baseline in epi else np.nan
+
+        epidict[point]=epi[point]/normalizer
+        qdict[point]=means['quarantines'][n]/normalizer
+        fpdict[point]=means['fq'][n]
+
+    return epidict,redudict,qdict,fpdict
+
+def paired_reductions(results,keys=['p_traced','p_app'],baseline=(0.0,0.0)):
+
+    '''Epidemic reduction (1-I/I at the baseline point) at each point of a sweep run with common random numbers
+       (episizes_tracing_cluster with common_random_numbers=True; results as returned by read_results), from paired runs:
+       each run is compared with the run of the same base_seed and iteration at the baseline, which had the same patient zero,
+       timelines and transmission draws, so the standard error comes from the variance of the differences only.
+       The baseline point has the values baseline of keys and the same values of the other swept parameters (the other
+       columns of results) as the run. Runs without a baseline run are left out. Returns the points (tuples of values of keys,
+       followed by those of the other swept parameters, if any), the reductions and their standard errors'''
+
+    others=[name for name in sorted(results) if not(name in keys or name in result_names or name in ['seed','iteration'])]
+
+    values=np.column_stack([np.asarray(results[key],dtype=float) for key in keys])
+
+    pairs=np.zeros(len(values),dtype=np.int64) # (base_seed,iteration,values of the others) as one integer
+
+    for column in [results['seed'][:,0],results['seed'][:,-1]]+[results[name] for name in others]:
+
+        column_values,inverse=np.unique(column,return_inverse=True)
+
+        pairs=pairs*len(column_values)+inverse
+
+    at_baseline=np.flatnonzero(np.all(np.isclose(values,baseline),axis=1))
+
+    if len(at_baseline)==0:
+
+        raise ValueError("No runs at the baseline point "+str(baseline))
+
+    order=at_baseline[np.argsort(pairs[at_baseline])]
+
+    match=np.minimum(np.searchsorted(pairs[order],pairs),len(order)-1)
+
+    paired=np.flatnonzero(pairs[order][match]==pairs)
+
+    baseline_infected=np.asarray(results['total_infected'],dtype=float)[order][match][paired]
+
+    differences={'baseline':baseline_infected,'difference':baseline_infected-np.asarray(results['total_infected'],dtype=float)[paired]}
+
+    for key in keys+others:
+
+        differences[key]=np.asarray(results[key])[paired]
+
+    points,N,means,variances=group_results(differences,keys+others,['baseline','difference'])
+
+    reductions=means['difference']/means['baseline']
+
+    errors=np.sqrt(variances['difference']/np.maximum(N-1,1))/means['baseline'] # standard error of the mean difference, relative
+
+    return points,reductions,errors
+
+def read_cluster(filename_root,filename_upto=None,datapath='your_path_here',normalizer=692.0):
+
+    '''Reads and averages data written by episizes_tracing_cluster into dictionaries, over the points of its grid.
+       With filename_upto=None, datapath+filename_root is a results directory of .npz parts (see write_results);
+       otherwise the printed output in the text files filename_root_0.out ... filename_root_<filename_upto>.out is read.
+       All the results must come from sweeps over the same grid parameters''' 
+
+    if filename_upto is None:
+
+        results,paramlist=read_results(datapath+filename_root)
+
+        grids=[[name for name,values in metadata.get('grid',[['p_traced',[]],['p_app',[]]])] for metadata in paramlist]
+
+        if any(not(names==grids[0]) for names in grids):
+
+            raise ValueError("The results in "+datapath+filename_root+" are of sweeps over different grids: "+str(grids))
+
+        return aggregate_results(results,grids[0] if grids else ['p_traced','p_app'],normalizer)
+
+    grid=None
+    columns=defaultdict(list)
+
+    for i in xrange(0,filename_upto+1):
+
+        filename=filename_root+"_"+str(i)+".out"
+
+        names=['p_traced','p_app'] # the grid of the file, and the values of p_traced and p_app if they are not in it (from the header)
+        fixed={}
+
+        with open(datapath+filename,'rU') as fn:
+
+            for number,line in enumerate(csv.reader(fn,delimiter='\t')):
+
+                if len(line)==0 or ':' in line[0]: # the 'Runs: ...' and 'Time: ...' footer
+
+                    continue
+
+                if line[0]=='Parameter':
+
+                    if line[1]=='grid':
+
+                        names=line[2:]
+
+                    elif line[1] in ['p_traced','p_app']:
+
+                        fixed[line[1]]=float(line[2])
+
+                    continue
+
+                if not(len(line)==len(names)+len(result_names)):
+
+                    raise ValueError("%s line %d: %d columns, expected %d (%s and the results)" % (filename,number+1,len(line),len(names)+len(result_names),", ".join(names)))
+
+                for name,value in zip(names+result_names,line):
+
+                    columns[name].append(float(value))
+
+                for name in fixed:
+
+                    if not(name in names):
+
+                        columns[name].append(fixed[name])
+
+        if grid is None:
+
+            grid=names
+
+        elif not(names==grid):
+
+            raise ValueError(filename+" is of a sweep over "+", ".join(names)+", not "+", ".join(grid))
+
+    return aggregate_results(dict((name,np.array(values)) for name,values in columns.items()),grid,normalizer)
+
+# ---------------- RUN STATISTICS
+
+# SEIR_onerun_grid(...,stats={}) fills the dictionary with the counters and wall times (in seconds) below;
+# times of the phases: time_events includes time_tracing, time_contacts (transmission) includes time_exposure,
+# time_recording is storing contacts for tracing. Without stats the run only pays for a few 'if profiling' checks.
+
+def new_run_stats():
+
+    '''Returns the counters and wall times of one run, all zero'''
+
+    return {'ticks':0,                    # time slots with contacts simulated
+            'blocks':0,                   # blocks of slots handled at once (between events)
+            'contact_pairs':0,            # contacts examined
+            'transmissions':0,            # exposures (not counting patient zero)
+            'events':dict((name,0) for name in event_names), # handled events by type
+            'tracing_calls':0,            # contact tracings (CT events)
+            'traced_contacts_visited':0,  # contacts of the traced students within tracelength scanned by tracing (see ContactTrace.trace)
+            'time_setup':0.0,
+            'time_events':0.0,
+            'time_tracing':0.0,
+            'time_contacts':0.0,
+            'time_exposure':0.0,
+            'time_recording':0.0,
+            'time_total':0.0}
+
+# ---------------- RUNNING MULTIPLE RUNS
+
+# a sweep runs SEIR_onerun_grid iterations times at each point of a grid of parameter values. The grid is a list of
+# (name,values) pairs, or a dictionary name:values (then sorted by name), and its points are all combinations of the values.
+# Names are keys of the intervention parameters (default_intervention_params) or the arguments of SEIR_onerun_grid in sweep_kwargs.
+# A sweep can be described in a JSON file, see read_sweep_config.
+
+sweep_kwargs=['p_transmission','initial_period_in_days'] # arguments of SEIR_onerun_grid that can be swept or set in a sweep
+
+def sweep_grid(grid):
+
+    '''Checks grid and returns it as a list of (name,values) pairs'''
+
+    if hasattr(grid,'items'):
+
+        grid=sorted(grid.items())
+
+    checked=[]
+
+    for name,values in grid:
+
+        if not(name in default_intervention_params or name in sweep_kwargs):
+
+            raise ValueError("Unknown sweep parameter "+str(name)+" (not an intervention parameter nor in sweep_kwargs)")
+
+        checked.append((name,[value.item() if hasattr(value,'item') else value for value in values])) # plain python values, also for numpy arrays
+
+    return checked
+
+def read_sweep_config(filename):
+
+    '''Reads a sweep from a JSON file and returns the keyword arguments of episizes_tracing_cluster for it:
+       {"grid": {"test_delay": [43200, 86400], "p_traced": [0.0, 0.5, 1.0]},     (or a list of [name, values] pairs)
+        "params": {"p_tested": 0.5},                                            (changes to default_intervention_params)
+        "kwargs": {"p_transmission": 0.00625},                                  (arguments of SEIR_onerun_grid, see sweep_kwargs)
+        "iterations": 100,
+        "common_random_numbers": true,                                          (see episizes_tracing_cluster)
+        "backend": "compiled"}
+       all entries are optional.'''
+
+    with open(filename) as f:
+
+        config=json.load(f)
+
+    unknown=set(config)-set(['grid','params','kwargs','iterations','common_random_numbers','backend'])
+
+    if len(unknown)>0:
+
+        raise ValueError("Unknown entries in "+filename+": "+", ".join(sorted(unknown)))
+
+    params=dict(default_intervention_params)
+
+    for name,value in config.get('params',{}).items():
+
+        if not(name in params):
+
+            raise ValueError("Unknown intervention parameter "+name+" in "+filename)
+
+        params[str(name)]=value
+
+    sweep={'params':params,'run_kwargs':dict((str(name),value) for name,value in config.get('kwargs',{}).items())}
+
+    if 'grid' in config:
+
+        sweep['grid']=[(str(name),values) for name,values in (sorted(config['grid'].items()) if hasattr(config['grid'],'items') else config['grid'])]
+
+    if 'iterations' in config:
+
+        sweep['iterations']=int(config['iterations'])
+
+    if 'common_random_numbers' in config:
+
+        sweep['common_random_numbers']=bool(config['common_random_numbers'])
+
+    if 'backend' in config:
+
+        sweep['backend']=str(config['backend'])
+
+    return sweep
+
+def slurm_shard():
+
+    '''Returns (index,count) of this task in a SLURM job array, or None outside job arrays'''
+
+    if not('SLURM_ARRAY_TASK_ID' in os.environ and 'SLURM_ARRAY_TASK_COUNT' in os.environ):
+
+        return None
+
+    return int(os.environ['SLURM_ARRAY_TASK_ID'])-int(os.environ.get('SLURM_ARRAY_TASK_MIN',0)),int(os.environ['SLURM_ARRAY_TASK_COUNT'])
+
+# the contact network and parameters of a parallel sweep are module globals so that worker
+# processes inherit them when they are forked (no copying or pickling of the contact data)
+
+_sweep_network=None
+_sweep_params=None
+_sweep_kwargs=None
+_sweep_names=None
+_sweep_profile=False
+_sweep_common=False
+_sweep_forks=False
+_sweep_backend='python'
+
+def _common_seed(task_seed): # with common random numbers, the runs of an iteration share (base_seed,iteration) at all points
+
+    return [task_seed[0],task_seed[-1]] if _sweep_common else None
+
+def _sweep_task(task):
+
+    '''Runs one (point,iteration) task of a sweep; task=(point,task_seed) where point has the values of the swept parameters
+       and task_seed seeds the run's random number generator.
+       Returns I,q,fp,stats where stats are the run statistics if the sweep is profiled, otherwise None'''
+
+    point,task_seed=task
+
+    params,kwargs=_sweep_point(point)
+
+    stats={} if _sweep_profile else None
+
+    I,q,fp=SEIR_onerun_grid(_sweep_network,params=params,rng=task_seed,stats=stats,common_rng=_common_seed(task_seed),backend=_sweep_backend,**kwargs)
+
+    return I,q,fp,stats
+
+def _sweep_batch(batch):
+
+    '''Runs a batch (a list) of tasks of a sweep together: tasks at the same point (see SEIR_batch_runs),
+       or if the sweep forks runs, tasks of the same iteration with the same _fork_key (see SEIR_forked_runs).
+       Returns a list of I,q,fp,None, one for each task'''
+
+    if len(batch)==1:
+
+        return [_sweep_task(batch[0])]
+
+    if _sweep_forks:
+
+        forks=[]
+
+        for point,task_seed in batch:
+
+            params,kwargs=_sweep_point(point) # the same kwargs for all, as they are not in tracing_params
+
+            forks.append((params,task_seed))
+
+        return [(I,q,fp,None) for I,q,fp in SEIR_forked_runs(_sweep_network,forks,_common_seed(batch[0][1]),**kwargs)]
+
+    point=batch[0][0]
+    task_seeds=[task[1] for task in batch]
+
+    params,kwargs=_sweep_point(point)
+
+    common_seeds=[_common_seed(task_seed) for task_seed in task_seeds] if _sweep_common else None
+
+    return [(I,q,fp,None) for I,q,fp in SEIR_batch_runs(_sweep_network,task_seeds,params=params,common_seeds=common_seeds,**kwargs)]
+
+def _fork_key(names,point,task_seed): # tasks with the same key can be forked from the same run: the iteration, and the values of the swept parameters other than tracing_params
+
+    return (task_seed[-1],)+tuple(value for name,value in zip(names,point) if not(name in tracing_params))
+
+def _sweep_point(point):
+
+    '''Returns params,kwargs of the runs at point (values of the swept parameters)'''
+
+    params=dict(_sweep_params)
+    kwargs=dict(_sweep_kwargs)
+
+    for name,value in zip(_sweep_names,point):
+
+        if name in sweep_kwargs:
+
+            kwargs[name]=value
+
+        else:
+
+            params[name]=value
+
+    return params,kwargs
+
+def _resume_sweep(results_dir,metadata,base_seed,shard):
+
+    '''Finds the runs of a sweep already written into results_dir (see episizes_tracing_cluster with resume=True).
+       With base_seed=None, the sweep with the same metadata (parameters and grid) in results_dir is resumed, if there is one.
+       Returns base_seed,done,part where done[(indices of the values of the point...,iteration)]=(I,q,fp)
+       and part is the number of the next part file of shard'''
+
+    if not os.path.isdir(results_dir):
+
+        return base_seed,{},0
+
+    metadata=json.loads(json.dumps(metadata,sort_keys=True)) # as stored in the parts
+
+    if base_seed is None:
+
+        seeds=set(int(filename.split('_')[1]) for filename in result_parts(results_dir))
+
+        seeds=sorted(seed for seed in seeds if read_results(results_dir,seed)[1]==[metadata]) # sweeps with the same parameters
+
+        if len(seeds)==0:
+
+            return base_seed,{},0
+
+        if len(seeds)>1:
+
+            raise ValueError("Several sweeps with these parameters in "+results_dir+" ("+", ".join(str(seed) for seed in seeds)+"), give the base_seed of the one to resume")
+
+        base_seed=seeds[0]
+
+    results,metadatalist=read_results(results_dir,base_seed)
+
+    if len(metadatalist)>0 and not(metadatalist==[metadata]):
+
+        raise ValueError("The sweep with base_seed "+str(base_seed)+" in "+results_dir+" was run with different parameters")
+
+    done={}
+
+    if len(metadatalist)>0:
+
+        for seed,I,q,fp in zip(results['seed'][:,1:].tolist(),*[results[name].tolist() for name in result_names]):
+
+            done[tuple(seed)]=(I,q,fp)
+
+    # after the last part of shard, even if some part before it is missing (a part numbered len(parts) may exist)
+
+    parts=[int(filename[:-len('.npz')].split('_')[-1]) for filename in result_parts(results_dir,base_seed,shard)]
+
+    return base_seed,done,max(parts)+1 if len(parts)>0 else 0
+
+def adaptive_iterations(samples,target_width,confidence_z=1.96,max_iterations=1000,max_runs=None):
+
+    '''Returns the number of additional runs at each point of a sweep, given samples (for each point, a list of results (I,q,fp)
+       of the runs so far): a point needs runs until the confidence interval of the mean of each result in target_width
+       (name:width) is at most that wide, estimated from the sample variance; a point gets at most as many runs as it has,
+       since the estimate improves with the runs, and at most max_iterations in all. If the runs needed
+       are more than max_runs, they are shared in proportion to the need, so that the noisiest points get the most'''
+
+    columns=[result_names.index(name) for name in sorted(target_width)]
+    widths=np.array([target_width[name] for name in sorted(target_width)],dtype=float)
+
+    need=np.zeros(len(samples),dtype=np.int64)
+
+    for k in xrange(0,len(samples)):
+
+        n=len(samples[k])
+
+        if n<2:
+
+            need[k]=2-n
+
+            continue
+
+        std=np.std(np.array(samples[k],dtype=float)[:,columns],axis=0,ddof=1)
+
+        needed=int(np.ceil(np.max((2.0*confidence_z*std/widths)**2))) # width=2*z*std/sqrt(n)
+
+        need[k]=max(0,min(needed,max_iterations)-n)
+
+    extra=np.minimum(need,[len(runs) for runs in samples])
+
+    if max_runs is not None and extra.sum()>max_runs:
+
+        share=extra*max(0,max_runs)//extra.sum()
+
+        leftover=max(0,max_runs)-share.sum()
+
+        for k in np.argsort(-(extra-share),kind='mergesort')[:leftover]: # the rest one by one to the largest remaining needs
+
+            share[k]+=1
+
+        extra=share
+
+    return extra.tolist()
+
+# a sweep can also be spread over any number of machines by a coordinator (episizes_tracing_cluster with coordinator=address)
+# and workers (sweep_worker) that connect to it over a socket (multiprocessing.connection; TCP for (host,port), or a unix socket
+# for a path). The coordinator hands out leases of a few consecutive batches (a block of iterations at a grid point)
+# and each worker gets a new lease as soon as it returns the results of the previous one, so fast workers do more runs.
+# The lease of a worker that disconnects (or does not answer within lease_timeout) is handed out again, and the worker
+# connects again for a new one; a lease lost max_lease_failures times fails the sweep, instead of waiting for workers
+# forever. When no leases are left, idle workers get a copy of a lease still running elsewhere, so that one slow worker
+# does not hold up the end of the sweep (runs are seeded, so both copies give the same results). The results come back
+# to the coordinator, which prints and writes them as in a local sweep
+
+def parse_address(text):
+
+    '''Returns the address of a coordinator given as host:port, or the path of a unix socket'''
+
+    if ':' in text:
+
+        host,port=text.rsplit(':',1)
+
+        return host,int(port)
+
+    return text
+
+# the coordinator and the workers run what they are sent (connections pickle their messages), so both need the same
+# authkey: a shared secret, without which nobody can connect. Workers only run the functions in sweep_functions
+
+sweep_functions=['_sweep_batch']
+
+def _check_authkey(authkey):
+
+    if not(authkey):
+
+        raise ValueError("A coordinated sweep needs an authkey, a secret shared by the coordinator and its workers (SWEEP_AUTHKEY for the script)")
+
+def _sweep_setup(): # what a worker needs to run the tasks of the sweep, besides the contact data
+
+    return {'params':_sweep_params,'kwargs':_sweep_kwargs,'names':_sweep_names,'profile':_sweep_profile,'common':_sweep_common,
+            'forks':_sweep_forks,'backend':_sweep_backend,'network':_network_fingerprint(_sweep_network)}
+
+def _network_fingerprint(network): # to check that a worker has the same contact data as the coordinator
+
+    return [network.N_students,len(network),network.max_time]
+
+class SweepCoordinator(object):
+
+    def __init__(self,address,authkey=None,lease_size=10,lease_timeout=None,max_lease_failures=3):
+
+        '''Listens for workers with authkey at address (see parse_address; port 0 for any free port, see self.address).
+           Leases have up to lease_size tasks; a lease not returned within lease_timeout seconds (default: no limit)
+           is taken from its worker and handed out again. When workers have lost the same lease max_lease_failures times
+           (timed out, or died running it), imap raises RuntimeError. Used like a multiprocessing.Pool (imap, terminate)'''
+
+        _check_authkey(authkey)
+
+        self.listener=multiprocessing.connection.Listener(address,authkey=authkey)
+
+        self.address=self.listener.address
+        self.authkey=authkey
+        self.lease_size=lease_size
+        self.lease_timeout=lease_timeout
+        self.max_lease_failures=max_lease_failures
+
+        self.lock=threading.Condition()
+
+        self.leases={}   # leases[lease]=(function name,batches) of the leases not done yet
+        self.queue=[]    # leases not handed out (again) yet, in order
+        self.running={}  # running[lease]=number of workers running it
+        self.results={}  # results[lease]=results of its batches, until taken by imap
+        self.failures={} # failures[lease]=number of times a worker lost it
+        self.error=None  # why the sweep failed
+        self.next_lease=0
+        self.closed=False
+
+        self.setup=_sweep_setup()
+
+        accepting=threading.Thread(target=self._accept)
+        accepting.daemon=True
+        accepting.start()
+
+    def _accept(self):
+
+        while not(self.closed):
+
+            try:
+
+                connection=self.listener.accept()
+
+            except Exception: # a worker that failed to connect (e.g. wrong authkey), or the listener was closed
+
+                continue
+
+            serving=threading.Thread(target=self._serve,args=(connection,))
+            serving.daemon=True
+            serving.start()
+
+    def _lease_for_worker(self):
+
+        '''The lease for an idle worker: the next in the queue, or a copy of a running lease, or None (the lock is held)'''
+
+        if len(self.queue)>0:
+
+            return self.queue.pop(0)
+
+        running=[lease for lease in sorted(self.running) if self.running[lease]==1 and not(lease in self.results)]
+
+        return running[0] if len(running)>0 else None # the oldest lease that has no copy running yet
+
+    def _serve(self,connection):
+
+        '''Hands out leases to the worker at connection, until the sweep is done or the worker is lost'''
+
+        lease=None
+
+        try:
+
+            connection.send(('setup',self.setup))
+
+            while True:
+
+                with self.lock:
+
+                    lease=None
+
+                    while not(self.closed):
+
+                        lease=self._lease_for_worker()
+
+                        if lease is not None:
+
+                            break
+
+                        self.lock.wait(1.0)
+
+                    if self.closed:
+
+                        connection.send(('done',))
+
+                        break
+
+                    self.running[lease]=self.running.get(lease,0)+1
+
+                    name,batches=self.leases[lease]
+
+                connection.send(('run',lease,name,batches))
+
+                if self.lease_timeout is not None and not(connection.poll(self.lease_timeout)):
+
+                    raise IOError("Lease "+str(lease)+" timed out")
+
+                returned,results=connection.recv()
+
+                with self.lock:
+
+                    if lease in self.running:
+
+                        self.running[lease]-=1
+
+                    if not(lease in self.results) and lease in self.leases: # the first copy to finish
+
+                        self.results[lease]=results
+
+                    lease=None
+
+                    self.lock.notify_all()
+
+        except Exception: # the worker was lost: its lease goes back to the front of the queue, unless another worker has a copy
+
+            with self.lock:
+
+                if lease is not None and lease in self.running:
+
+                    self.running[lease]-=1
+
+                    self.failures[lease]=self.failures.get(lease,0)+1
+
+                    if self.failures[lease]>=self.max_lease_failures and not(lease in self.results):
+
+                        self.error=("Lease "+str(lease)+" was lost by workers "+str(self.failures[lease])+" times (lease_timeout "+
+                                    str(self.lease_timeout)+" s); the workers may be too slow for it, or crash on it")
+
+                    elif self.running[lease]==0 and not(lease in self.results):
+
+                        self.queue.insert(0,lease)
+
+                self.lock.notify_all()
+
+        finally:
+
+            connection.close()
+
+    def imap(self,function,batches):
+
+        '''Runs function (a function of this module in sweep_functions, e.g. _sweep_batch) on each of batches on the workers;
+           yields the results in the order of batches'''
+
+        if not(function.__name__ in sweep_functions):
+
+            raise ValueError("Workers only run the functions in sweep_functions")
+
+        batches=list(batches)
+
+        leases=[]
+
+        with self.lock:
+
+            for start in xrange(0,len(batches)):
+
+                if len(leases)==0 or sum(len(batch) for batch in self.leases[leases[-1]][1])+len(batches[start])>self.lease_size:
+
+                    leases.append(self.next_lease)
+
+                    self.leases[self.next_lease]=(function.__name__,[])
+                    self.queue.append(self.next_lease)
+
+                    self.next_lease+=1
+
+                self.leases[leases[-1]][1].append(batches[start])
+
+            self.lock.notify_all()
+
+        for lease in leases:
+
+            with self.lock:
+
+                while not(lease in self.results):
+
+                    if self.error is not None:
+
+                        raise RuntimeError(self.error)
+
+                    self.lock.wait(1.0)
+
+                results=self.results.pop(lease)
+
+                del self.leases[lease]
+
+                self.running.pop(lease,None)
+
+            for result in results:
+
+                yield result
+
+    def terminate(self):
+
+        '''Tells the workers that the sweep is done and stops listening'''
+
+        with self.lock:
+
+            self.closed=True
+
+            self.lock.notify_all()
+
+        try: # wakes up the listener
+
+            multiprocessing.connection.Client(self.address,authkey=self.authkey).close()
+
+        except Exception:
+
+            pass
+
+        self.listener.close()
+
+def sweep_worker(address,network,authkey=None,processes=1,connect_timeout=60.0):
+
+    '''Does runs of the sweep coordinated at address (see SweepCoordinator) until the sweep is done;
+       network is the contact data of the sweep (the same as the coordinator's, e.g. from read_contacts),
+       authkey the secret shared with the coordinator.
+       With processes>1, that many worker processes are forked. Waits up to connect_timeout seconds for the coordinator
+       to start, and connects again when the coordinator takes a lease back (or for connect_timeout seconds, when it is gone).
+       Returns the number of leases done (in all processes)'''
+
+    global _sweep_network,_sweep_params,_sweep_kwargs,_sweep_names,_sweep_profile,_sweep_common,_sweep_forks,_sweep_backend
+
+    _check_authkey(authkey)
+
+    if processes>1:
+
+        _sweep_network=network
+
+        if isinstance(network,ContactNetwork):
+
+            network.students_between(0,0) # the student index for tracing, shared by the forked processes too
+
+        pool=multiprocessing.Pool(processes) # forked, sharing network
+
+        try:
+
+            return sum(pool.map(_sweep_worker_process,[(address,authkey,connect_timeout)]*processes))
+
+        finally:
+
+            pool.terminate()
+
+    leases=0
+    connected=False # to the coordinator, at least once
+
+    while True: # connects again after losing a lease (see SweepCoordinator), until the sweep is done
+
+        t_start=time()
+
+        while True:
+
+            try:
+
+                connection=multiprocessing.connection.Client(address,authkey=authkey)
+
+                break
+
+            except (IOError,OSError): # socket.error too
+
+                if time()-t_start>connect_timeout:
+
+                    if connected: # the coordinator is gone
+
+                        return leases
+
+                    raise
+
+                sleep(1.0)
+
+        connected=True
+        done=False
+
+        try:
+
+            while True:
+
+                try:
+
+                    message=connection.recv()
+
+                except (EOFError,IOError): # the coordinator took the lease back, or is gone
+
+                    break
+
+                if message[0]=='setup':
+
+                    setup=message[1]
+
+                    if not(_network_fingerprint(network)==setup['network']):
+
+                        raise ValueError("The contact data of the worker (students,contacts,max_time "+str(_network_fingerprint(network))+") is not that of the sweep "+str(setup['network']))
+
+                    _sweep_network=network
+                    _sweep_params=setup['params']
+                    _sweep_kwargs=setup['kwargs']
+                    _sweep_names=setup['names']
+                    _sweep_profile=setup['profile']
+                    _sweep_common=setup['common']
+                    _sweep_forks=setup['forks']
+                    _sweep_backend=setup['backend']
+
+                elif message[0]=='run':
+
+                    lease,name,batches=message[1:]
+
+                    if not(name in sweep_functions):
+
+                        raise ValueError("The coordinator asked for "+str(name)+", which is not in sweep_functions")
+
+                    function=globals()[name]
+
+                    results=[function(batch) for batch in batches]
+
+                    try:
+
+                        connection.send((lease,results))
+
+                    except IOError: # the coordinator took the lease back, or is gone
+
+                        break
+
+                    leases+=1
+
+                else:
+
+                    done=True
+
+                    break
+
+        finally:
+
+            connection.close()
+
+        if done:
+
+            return leases
+
+def _sweep_worker_process(arguments): # a worker process of sweep_worker(...,processes>1)
+
+    address,authkey,connect_timeout=arguments
+
+    return sweep_worker(address,_sweep_network,authkey,1,connect_timeout)
+
+def episizes_tracing_cluster(network,params,iterations=10,processes=1,base_seed=None,profile_file=None,results_dir=None,batch_size=1000,checkpoint_interval=300.0,resume=False,grid=None,run_kwargs={},shard=None,target_width=None,max_iterations=1000,max_runs=None,confidence_z=1.96,replicates=1,common_random_numbers=False,backend='python',coordinator=None,authkey=None,lease_size=10,lease_timeout=None,max_lease_failures=3):
+
+    '''Runs iterations run of the SEIR model with the CH data (a ContactNetwork, see read_contacts; an old-style contact dict
+    is converted once here, see as_network) using parameters defined in params,
+    at each point of grid (see sweep_grid); by default over the ranges of manual contact tracing probabilities and app probabilities
+    defined below. run_kwargs are passed to SEIR_onerun_grid (see sweep_kwargs). params is not modified.
+    Developed for parallel runs using a cluster, so prints out all results (values of the swept parameters, I, q, fp)
+    so that they can be piped into a file and read later (example reader code is above).
+    With processes>1 the runs are spread over a pool of forked worker processes that share the contact data;
+    results are still printed in the same order. With shard=(index,count), only every count'th run starting from index is done,
+    so that count jobs (e.g. a SLURM job array with the same base_seed, see slurm_shard) share the sweep.
+    Each run is seeded with (base_seed,index of the value of each swept parameter,iteration),
+    so a sweep can be repeated exactly by giving the base_seed printed in its header.
+    With profile_file, the run statistics (see new_run_stats) of every run are written to it as JSON lines,
+    one record per run with its parameter values, iteration and seed.
+    With results_dir, the results are also written into it in columns, batch_size runs per .npz part file
+    (see write_results); read_cluster(results_dir,datapath='') then averages them.
+    The parts also serve as checkpoints: a part is written at the latest checkpoint_interval seconds after the previous one.
+    With resume=True, the runs of this sweep (the same base_seed, or with base_seed=None
+    the sweep with the same params and grid) already in results_dir are not run again but printed from there,
+    so an interrupted sweep continues where it stopped and gives the same results as an uninterrupted one.
+    With target_width (dictionary result name:width, e.g. {'total_infected':20.0,'fq':0.1}), the number of runs is adaptive:
+    after iterations runs at each point, more runs are done in rounds at the points where the confidence interval
+    (confidence_z standard errors on both sides) of the mean of any of these results is still wider than its target,
+    until all are narrow enough, or a point has max_iterations runs, or the sweep has max_runs runs (see adaptive_iterations).
+    Then shards take every count'th grid point instead of every count'th run.
+    With replicates>1, up to replicates runs at the same point are run together by SEIR_batch_runs, which is faster
+    and gives the same results as single runs; profile_file then needs replicates=1.
+    With common_random_numbers=True, the runs of the same iteration at all points share common random numbers
+    (common_rng=(base_seed,iteration), see Population): the same patient zero, start time, disease timelines and
+    transmission draws, so that differences between points are only due to the interventions (see paired_reductions).
+    The runs of an iteration at points that differ only in tracing_params are then forked from one run (see SEIR_forked_runs),
+    with the same results, and printed together (unless replicates>1 or with profile_file).
+    backend is passed to SEIR_onerun_grid; the compiled backend cannot be combined with profile_file, replicates>1
+    or common random numbers.
+    With coordinator=address (see parse_address), the runs are done by workers that connect to address with authkey,
+    a secret shared with them that is required (see sweep_worker) instead of here, lease_size tasks at a time (see SweepCoordinator for lease_timeout and max_lease_failures);
+    the results are the same as those of a local sweep.'''
+
+    global _sweep_network,_sweep_params,_sweep_kwargs,_sweep_names,_sweep_profile,_sweep_common,_sweep_forks,_sweep_backend
+
+    if not(hasattr(params,'items')): # the old form episizes_tracing_cluster(contactdict,student_ids,params,iterations)
+
+        raise TypeError("episizes_tracing_cluster takes (network,params,iterations,...), not (contactdict,student_ids,params,iterations): "
+                        "pass as_network(contactdict,student_ids) or read_contacts() as the network")
+
+    network=as_network(network) # built once for all runs, instead of in every run
+
+    if grid is None:
+
+        app_probabilities=np.arange(0.0,1.1,0.1)
+        trace_hitrates=np.arange(0.0,1.1,0.1)
+
+        grid=[('p_traced',trace_hitrates),('p_app',app_probabilities)]
+
+    grid=sweep_grid(grid)
+
+    for name in run_kwargs:
+
+        if not(name in sweep_kwargs):
+
+            raise ValueError("Unknown argument "+name+" in run_kwargs (see sweep_kwargs)")
+
+    names=[name for name,values in grid]
+
+    if replicates>1 and profile_file is not None:
+
+        raise ValueError("Runs in batches (replicates>1) have no run statistics for profile_file")
+
+    if not(backend in backends):
+
+        raise ValueError("Unknown backend "+str(backend)+" (see backends)")
+
+    if backend=='compiled' and numba is None: # not installed
+
+        backend='python'
+
+    if backend=='compiled' and (profile_file is not None or replicates>1 or common_random_numbers):
+
+        raise ValueError("The compiled backend has no run statistics for profile_file, batches or common random numbers")
+
+    if coordinator is not None and shard is not None:
+
+        raise ValueError("A coordinated sweep is not sharded: its workers share all of its runs")
+
+    shard_index,shard_count=shard if shard is not None else (0,1)
+
+    metadata={'params':params,'grid':grid,'run_kwargs':run_kwargs}
+
+    if common_random_numbers:
+
+        metadata['common_random_numbers']=True
+
+    if not(backend=='python'):
+
+        metadata['backend']=backend
+
+    done={} # results of runs found in results_dir when resuming
+    part=0
+
+    if resume and results_dir is not None:
+
+        base_seed,done,part=_resume_sweep(results_dir,metadata,base_seed,shard_index)
+
+    if base_seed is None:
+
+        base_seed=int(np.random.randint(0,2**31-1))
+
+    t1=time()
+
+    for parameter in params:
+
+        print "Parameter\t"+parameter+"\t"+str(params[parameter])
+
+    for name in run_kwargs:
+
+        print "Parameter\t"+name+"\t"+str(run_kwargs[name])
+
+    print "Parameter\tbase_seed\t"+str(base_seed)
+
+    if target_width is not None:
+
+        for name in sorted(target_width):
+
+            if not(name in result_names):
+
+                raise ValueError("Unknown result "+name+" in target_width (see result_names)")
+
+            print "Parameter\ttarget_width_"+name+"\t"+str(target_width[name])
+
+        print "Parameter\tmax_iterations\t"+str(max_iterations)
+        print "Parameter\tmax_runs\t"+str(max_runs)
+
+    if replicates>1:
+
+        print "Parameter\treplicates\t"+str(replicates)
+
+    if common_random_numbers:
+
+        print "Parameter\tcommon_random_numbers\tTrue"
+
+    if not(backend=='python'):
+
+        print "Parameter\tbackend\t"+backend
+
+    print "Parameter\tgrid\t"+"\t".join(names)
+
+    if shard is not None:
+
+        print "Parameter\tshard\t"+str(shard_index)+"/"+str(shard_count)
+
+    # the grid points, as (indices of the values,values); with adaptive iterations each shard takes every shard_count'th point
+
+    points=[]
+
+    for indices in itertools.product(*[xrange(0,len(values)) for name,values in grid]):
+
+        points.append((indices,tuple(grid[k][1][indices[k]] for k in xrange(0,len(grid)))))
+
+    if target_width is not None:
+
+        points=points[shard_index::shard_count]
+
+    # first round: iterations runs at each point, as (point,seed) tasks in the order of the grid, iterations innermost;
+    # without adaptive iterations each shard takes every shard_count'th task, and only builds those (task k is
+    # iteration k%iterations at point k//iterations)
+
+    if target_width is None:
+
+        task_numbers=xrange(shard_index,len(points)*iterations,shard_count)
+
+    else:
+
+        task_numbers=xrange(0,len(points)*iterations)
+
+    tasks=[(points[k//iterations][1],[base_seed]+list(points[k//iterations][0])+[k%iterations]) for k in task_numbers]
+
+    _sweep_network=network
+    _sweep_params=dict(params)
+    _sweep_kwargs=dict(run_kwargs)
+    _sweep_names=names
+    _sweep_profile=profile_file is not None
+    _sweep_common=common_random_numbers
+    _sweep_backend=backend
+    _sweep_forks=common_random_numbers and replicates==1 and not(_sweep_profile) and any(name in tracing_params for name in names)
+
+    profile=open(profile_file,'a' if len(done)>0 else 'w') if _sweep_profile else None
+
+    columns=defaultdict(list) # results not yet written to results_dir
+    last_write=time()
+
+    samples=defaultdict(list) # samples[indices]=results (I,q,fp) of the runs at a point so far
+
+    if coordinator is not None: # or run by the workers of the coordinator
+
+        pool=SweepCoordinator(coordinator,authkey,lease_size,lease_timeout,max_lease_failures)
+
+        print "Parameter\tcoordinator\t"+str(pool.address)
+
+    else:
+
+        if processes>1 and isinstance(network,ContactNetwork):
+
+            network.students_between(0,0) # the student index for tracing, made before the workers are forked so that they share it
+
+        pool=multiprocessing.Pool(processes) if processes>1 else None # workers are forked here and inherit the globals above
+
+    try:
+
+        while len(tasks)>0:
+
+            if _sweep_forks: # the tasks that are forked from the same run next to each other
+
+                groups={}
+
+                for point,task_seed in tasks:
+
+                    groups.setdefault(_fork_key(names,point,task_seed),len(groups))
+
+                tasks=sorted(tasks,key=lambda task: groups[_fork_key(names,task[0],task[1])])
+
+            pending=[task for task in tasks if not(tuple(task[1][1:]) in done)]
+
+            # batches of consecutive pending tasks: up to replicates tasks at the same point, or the tasks forked from the same run
+
+            batches=[]
+
+            for point,task_seed in pending:
+
+                if _sweep_forks and len(batches)>0 and _fork_key(names,*batches[-1][-1])==_fork_key(names,point,task_seed):
+
+                    batches[-1].append((point,task_seed))
+
+                elif len(batches)>0 and batches[-1][0][0]==point and len(batches[-1])<replicates:
+
+                    batches[-1].append((point,task_seed))
+
+                else:
+
+                    batches.append([(point,task_seed)])
+
+            if pool is not None:
+
+                computed=pool.imap(_sweep_batch,batches) # results stream back in task order
+
+            else:
+
+                computed=(_sweep_batch(batch) for batch in batches)
+
+            computed=itertools.chain.from_iterable(computed)
+
+            # all results in task order: those found when resuming, and the computed ones
+
+            results=(done[tuple(task[1][1:])]+(None,) if tuple(task[1][1:]) in done else next(computed) for task in tasks)
+
+            for (point,task_seed),(I,q,fp,stats) in itertools.izip(tasks,results):
+
+                print "\t".join(str(value) for value in point)+"\t"+str(I)+"\t"+str(q)+"\t"+str(fp)
+
+                samples[tuple(task_seed[1:-1])].append((I,q,fp))
+
+                if tuple(task_seed[1:]) in done:
+
+                    continue
+
+                values=dict(zip(names,point))
+
+                for name in ['p_traced','p_app']:
+
+                    if not(name in values):
+
+                        values[name]=params[name]
+
+                if profile is not None:
+
+                    stats.update(values)
+                    stats.update(iteration=task_seed[-1],seed=task_seed,total_infected=I,quarantines=q,fq=fp)
+
+                    profile.write(json.dumps(stats,sort_keys=True)+"\n")
+
+                if results_dir is not None:
+
+                    for name in values:
+
+                        columns[name].append(values[name])
+
+                    columns['seed'].append(task_seed)
+                    columns['iteration'].append(task_seed[-1])
+
+                    for name,value in zip(result_names,(I,q,fp)):
+
+                        columns[name].append(value)
+
+                    if len(columns['seed'])>=batch_size or time()-last_write>=checkpoint_interval:
+
+                        write_results(results_dir,columns,metadata,base_seed,shard_index,part)
+
+                        columns=defaultdict(list)
+                        part+=1
+                        last_write=time()
+
+            if target_width is None:
+
+                break
+
+            # next round: more runs at the points whose confidence intervals are still too wide
+
+            runs=sum(len(samples[indices]) for indices,point in points)
+
+            extra=adaptive_iterations([samples[indices] for indices,point in points],target_width,confidence_z,max_iterations,None if max_runs is None else max_runs-runs)
+
+            tasks=[(point,[base_seed]+list(indices)+[i]) for (indices,point),n in zip(points,extra) for i in xrange(len(samples[indices]),len(samples[indices])+n)]
+
+        if results_dir is not None and len(columns['seed'])>0:
+
+            write_results(results_dir,columns,metadata,base_seed,shard_index,part)
+
+    finally:
+
+        if pool is not None:
+
+            pool.terminate()
+
+        if profile is not None:
+
+            profile.close()
+
+    print "Runs: "+str(sum(len(runs) for runs in samples.values()))
+    print "Time: "+str((time()-t1)/60.0)+" min"
+
+def SEIR_onerun_grid(network,student_ids=None,params=default_intervention_params,first_times={},p_transmission=0.00625,initial_period_in_days=7,I_only=False,chain=False,dailynets=False,nets_per_day=8,animate=False,curr_layout=[],R0=False,rng=None,stats=None,common_rng=None,backend='python'):
+
+    '''Does one run of the SEIR model, returning various items depending on user choice (see end of function).
+       Required inputs:
+                network: ContactNetwork returned by read_contacts (build it once and reuse it for all runs);
+                         an old-style dictionary[time]=[contact1,contact2,contact2] where contact=(student_id1,student_id2)
+                         is also accepted but is converted on every call
+                student_ids: only used with an old-style dictionary, set of all student ids in it
+       User choices:
+                first_times: ignored, kept for compatibility (first contact times are precomputed in ContactNetwork)
+                p_transmission: probability of transmission from I to S in one timestep, default p=0.004
+                initial_period_in_days: determines infection time of first patient (first contact time + randomly drawn time from initial_period_in_days)
+                I_only: if True, the run only returns the final number of infected 
+                chain: if True, the run also returns the transmission chain as an event list [(source1,target1,time1),(source2,...]
+                         of student indices in the network (source -1 for patient zero), or a ChainLog to write the chain into instead
+                dailynets: if True, the run also returns a snapshot for each period: a list of (time,states,in_quarantine,edges)
+                         with the state codes of the students at the end of the period and the contacts of the period
+                         (edge_dtype), or a SnapshotLog to write the snapshots into instead (see RunOutputs)
+                nets_per_day: (default=8) how many nets to return per day in dailynets and how many frames per day for animations
+                animate: if True, the run only returns a list of frames to be animated with moviepy.editor.ImageSequenceClip(),
+                         or animate can be a function that is called with each frame instead (e.g. the append_data of an imageio writer)
+                curr_layout=[]: only used for animation, if one wants to start from a pre-determined node layout:
+                         positions in the order of the student indices, or a dictionary {student_id:(x,y)}
+                R0: if True, only patient zero infects others (the students it infects do not become infectious) and the run ends
+                         when it recovers; the run only returns the number of students infected by patient zero
+                         (see secondary_cases for many index cases at once)
+                rng: seed (int or sequence of ints) or numpy RandomState/Generator; all random draws of the run come from it,
+                     so runs with the same seed are identical (default: a fresh unpredictable seed)
+                common_rng: a seed for common random numbers (see Population): runs with the same common_rng have the same
+                     patient zero, start time, disease timelines and transmission draws, and only the randomness of the
+                     intervention (from rng) differs, so that interventions can be compared run by run
+                stats: if a dictionary is given, it is filled with counters and wall times of the run (see new_run_stats);
+                       with the default None nothing is measured
+                backend: 'python', or 'compiled' for the compiled kernel (see compiled_run; faster, the same model but
+                       not the same random numbers, without stats and common_rng); if numba is not installed,
+                       the python backend is used
+        Outputs:
+                depend on the above choices. See end of function'''
+
+    profiling=stats is not None
+
+    if profiling:
+
+        stats.update(new_run_stats())
+
+        t_start=time()
+
+    network=as_network(network,student_ids)
+
+    if not(backend in backends):
+
+        raise ValueError("Unknown backend "+str(backend)+" (see backends)")
+
+    if backend=='compiled' and numba is not None:
+
+        if profiling or common_rng is not None or not(isinstance(network,ContactNetwork)) or chain or dailynets or animate or R0:
+
+            raise ValueError("The compiled backend needs a ContactNetwork, and has no stats, common_rng, outputs or R0")
+
+        return compiled_run(network,params,p_transmission,initial_period_in_days,rng)
+
+    run=RunState(network,params,rng,common_rng,initial_period_in_days) # the population, with patient zero exposed
+
+    outputs=None
+
+    if chain or dailynets or animate:
+
+        outputs=RunOutputs(network,chain,dailynets,nets_per_day,animate,curr_layout)
+
+        outputs.begin(run.patient_zero,run.start_time)
+
+    if profiling:
+
+        stats['time_setup']=time()-t_start
+
+    advance_run(network,run,params,p_transmission,stats,outputs=outputs,secondary_only=R0)
+
+    if profiling:
+
+        stats['transmissions']=run.total_infected-1
+        stats['tracing_calls']=stats['events']['CT']
+        stats['time_total']=time()-t_start
+
+    if outputs is not None and outputs.snapshotting: # the last period, up to the end of the run
+
+        outputs.snapshot(run.population)
+
+    if animate is True:
+
+        return outputs.frames
+
+    if R0:
+
+        return run.total_infected-1
+
+    results=run.results() # the final total number of infected + ppl in quarantine + false positive ratios
+
+    if chain is True:
+
+        results+=(outputs.chain,)
+
+    if dailynets is True:
+
+        results+=(outputs.snapshots,)
+
+    return results
+
+# ---------------- RUN STATE
+
+# a run of SEIR_onerun_grid is set up as a RunState and then advanced time slot by time slot by advance_run;
+# the RunState between time slots has everything needed to continue the run, so a run can also be forked:
+# with common random numbers (see Population) runs that differ only in the tracing interventions are the same
+# until the first contact tracing, so that part is simulated once and the runs are forked there (see SEIR_forked_runs)
+
+extinction_check_interval=day/4 # runs are checked for extinction (see extinct) at most this often in simulated time
+
+tracing_params=['p_traced','p_app','manual_tracing_threshold','app_tracing_threshold','trace_delay_manual','trace_delay_app'] # intervention parameters that only matter from the first contact tracing on
+
+reused_populations={} # reused_populations[N_students]: the Population of the runs of this process (see RunState)
+
+class RunState(object):
+
+    def __init__(self,network,params,rng=None,common_rng=None,initial_period_in_days=7,record_contacts=None,reuse=True):
+
+        '''Sets up a run on network (a ContactNetwork): the population (see Population for rng and common_rng),
+           and patient zero exposed at its start time. With record_contacts=None, contacts are recorded for tracing
+           if they can be traced with params. With reuse=True, the population of the previous run of this process
+           with as many students is reset and reused (see reused_populations), instead of making a new one'''
+
+        N_students=network.N_students # students are referred to by their dense index 0..N_students-1 during the run
+
+        max_time=network.max_time
+
+        if reuse and N_students in reused_populations:
+
+            population=reused_populations[N_students]
+
+            population.reset(params,rng,common_rng)
+
+        else:
+
+            population=Population(N_students,params,rng,common_rng) # state arrays of all students
+
+            if reuse:
+
+                reused_populations[N_students]=population
+
+        patient_zero_index=population.common_rng.choice(N_students)
+
+        # all students, so that studentlist[i] = class Node in S state
+
+        studentlist=population.students(params)
+        students_with_apps=set(np.flatnonzero(population.has_app).tolist())
+
+        if record_contacts is None:
+
+            record_contacts=params['p_traced']>0 or len(students_with_apps)>0 # contacts are only needed if they can be traced
+
+        # initialize event queue
+
+        eventq=EventQueue() # state changes, quarantines and tracing, ordered by time
+
+        # find first event where patient zero participates; start from there.
+
+        curr_time=int(network.first_times[patient_zero_index]) # pick first event of patient zero as starting time
+
+        curr_time=curr_time+int(timestep_in_data*round((day*population.common_rng.uniform()*initial_period_in_days)/timestep_in_data)) # add 0-7 days at random
+
+        studentlist[patient_zero_index].exposure(eventq,curr_time,params) # now expose patient zero
+
+        # the data is repeated periodically; at absolute time curr_time the contacts of data time curr_time-periodic_boundary_modifier take place
+
+        periodic_boundary_modifier=0
+
+        while (curr_time-periodic_boundary_modifier)>max_time:
+
+            periodic_boundary_modifier+=max_time+300
+
+        self.population=population
+        self.studentlist=studentlist
+        self.students_with_apps=students_with_apps
+        self.record_contacts=record_contacts
+        self.trace=ContactTrace(network,params['tracelength']) # the contacts recorded for tracing
+        self.eventq=eventq
+
+        if params['oddweeks']: # the students present on even weeks (oddweek 0) and on odd weeks
+
+            self.present=[population.oddweek==0,population.oddweek==1]
+
+        else:
+
+            self.present=None
+
+        self.contact_views=[None,None] # their contacts (see presence_view), when first needed
+
+        self.curr_time=curr_time
+        self.slot=np.searchsorted(network.times,curr_time-periodic_boundary_modifier) # next time slot with contacts
+        self.periodic_boundary_modifier=periodic_boundary_modifier
+
+        self.patient_zero=patient_zero_index
+        self.start_time=curr_time
+
+        self.exposed=1
+        self.infectious=0
+        self.total_infected=1
+        self.quarantines=0
+        self.false_quarantines=0
+
+        self.done=False
+
+    def fork(self,params,rng):
+
+        '''Returns a copy of the run that continues with params, which may differ from the params of the run only
+           in tracing_params, and with rng for the interventions, as if it had been set up with them.
+           Only for runs with common random numbers that have not traced anyone yet (see advance_run with until_tracing=True)'''
+
+        population=copy.copy(self.population)
+
+        population.rng=make_rng(rng)
+
+        for name in ['state','infectious','dampingfactor','in_quarantine','recovery_time','quarantine_end']:
+
+            setattr(population,name,getattr(self.population,name).copy())
+
+        population.has_app=population.app_draws<params['p_app']
+
+        population.studentlist=[node.fork(population) for node in self.studentlist]
+
+        forked=copy.copy(self)
+
+        forked.population=population
+        forked.studentlist=population.studentlist
+        forked.students_with_apps=set(np.flatnonzero(population.has_app).tolist())
+        forked.record_contacts=params['p_traced']>0 or len(forked.students_with_apps)>0
+        forked.trace=self.trace.copy()
+        forked.eventq=self.eventq.copy()
+
+        return forked
+
+    def results(self):
+
+        '''Returns total_infected,quarantines,fq (the fraction of false quarantines) of the run'''
+
+        if self.quarantines>0:
+
+            fq=float(self.false_quarantines)/self.quarantines
+
+        else:
+
+            fq=0.0
+
+        return self.total_infected,self.quarantines,fq
+
+def extinct(population,eventq):
+
+    '''True if no-one can be infected any more and the results of the run cannot change either: no-one is exposed,
+       all infectious students are in quarantine until they recover, and no contact tracing or traced quarantine is pending'''
+
+    if (population.state==state_codes['E']).any():
+
+        return False
+
+    infectious=np.flatnonzero(population.infectious)
+
+    if not(population.in_quarantine[infectious].all() and (population.quarantine_end[infectious]>=population.recovery_time[infectious]).all()):
+
+        return False
+
+    return not(eventq.has_events([event_codes['CT'],event_codes['BOQ_t']]))
+
+def advance_run(network,run,params,p_transmission,stats=None,until_tracing=False,outputs=None,secondary_only=False):
+
+    '''Continues run (a RunState) on network until it is done: no-one is exposed or infectious, or see extinct.
+       params and p_transmission as in SEIR_onerun_grid; stats (if given) are added to as in SEIR_onerun_grid.
+       With until_tracing=True, the run stops before the events of the first contact tracing instead, if there is one.
+       outputs (a RunOutputs, if given) gets the transmissions and snapshots of the run. With secondary_only=True, the students
+       infected are only counted (see SEIR_onerun_grid with R0). Returns True if the run stopped before tracing'''
+
+    profiling=stats is not None
+
+    snapshotting=outputs is not None and outputs.snapshotting
+
+    N_students=network.N_students
+
+    max_time=network.max_time
+
+    # local references to the run state, and to the state arrays used when handling contacts
+
+    population=run.population
+    studentlist=run.studentlist
+    students_with_apps=run.students_with_apps
+    record_contacts=run.record_contacts
+    trace=run.trace
+    eventq=run.eventq
+
+    present=run.present
+    contact_views=run.contact_views
+
+    transmission_key=population.transmission_key
+
+    state=population.state
+    is_infectious=population.infectious
+    dampingfactor=population.dampingfactor
+    in_quarantine=population.in_quarantine
+
+    susceptible=state_codes['S']
+    recovered=state_codes['R']
+    traced_quarantine=event_codes['BOQ_t']
+    contact_tracing=event_codes['CT']
+
+    curr_time=run.curr_time
+    slot=run.slot
+    periodic_boundary_modifier=run.periodic_boundary_modifier
+
+    exposed=run.exposed
+    infectious=run.infectious
+    total_infected=run.total_infected
+    quarantines=run.quarantines
+    false_quarantines=run.false_quarantines
+
+    done=run.done
+    stopped=False
+
+    next_extinction_check=curr_time
+
+    while not (done):
+
+        contact_time=int(network.times[slot])+periodic_boundary_modifier
+        event_time=eventq.next_time()
+
+        if snapshotting: # the states at the end of each period are those before its next event or contact
+
+            while min(contact_time,contact_time if event_time is None else event_time)>=outputs.next_snapshot:
+
+                outputs.snapshot(population)
+
+        # --------- handle event queue; events at a time slot are handled before its contacts
+
+        if event_time is not None and event_time<=contact_time:
+
+            if until_tracing and eventq.has_events([contact_tracing],event_time): # the first contact tracing: stop before it
+
+                stopped=True
+
+                break
+
+            curr_time=event_time
+
+            if profiling:
+
+                t_phase=time()
+
+            for student,event in eventq.pop_events(curr_time): # eventq events: (student_id,event_code)
+
+                if event==traced_quarantine and not(in_quarantine[student]):
+
+                    quarantines+=1
+
+                    if state[student]==susceptible or state[student]==recovered:
+
+                        false_quarantines+=1
+
+                elif event==recovered: # book-keeping for the various classes (S=susceptible,E=exposed,Ip=presymptomatic infectious,I=infectious, Ic=cumulative number of infected, R=recovered)
+
+                    infectious-=1
+
+                elif event<len(infectious_states) and infectious_states[event]:
+
+                    exposed-=1
+                    infectious+=1
+
+                if profiling:
+
+                    stats['events'][event_names[event]]+=1
+
+                if event==contact_tracing: # traced from the recorded contacts of the run
+
+                    if profiling:
+
+                        t_trace=time()
+
+                    contacts,scanned=trace.trace(student,curr_time)
+
+                    studentlist[student].quarantine_contacts(contacts,eventq,curr_time,params,students_with_apps)
+
+                    if profiling:
+
+                        stats['traced_contacts_visited']+=scanned
+                        stats['time_tracing']+=time()-t_trace
+
+                    continue
+
+                studentlist[student].statechange(eventq,event,curr_time,params,students_with_apps) # change student's state (disease progression, quarantine)
+
+            if profiling:
+
+                stats['time_events']+=time()-t_phase
+
+            continue
+
+        curr_time=contact_time
+
+        if (exposed+infectious)==0: # simulation done when no-one is infectious or exposed
+
+            done=True
+
+            break
+
+        if curr_time>=next_extinction_check: # or when no-one can infect anyone any more
+
+            if extinct(population,eventq):
+
+                done=True
+
+                break
+
+            next_extinction_check=curr_time+extinction_check_interval
+
+        # --------- handle transmission and contacts
+        # states only change at events and exposures, so all slots up to the next event
+        # (or the end of the data) are handled at once: contacts between first_slot and end_slot
+
+        if profiling:
+
+            t_phase=time()
+
+        first_slot=slot
+
+        if event_time is None:
+
+            end_slot=len(network.times)
+
+        else:
+
+            end_slot=np.searchsorted(network.times,event_time-periodic_boundary_modifier)
+
+        contacts=network
+
+        if present is not None: # and to the end of the week; only the contacts between students present this week take place
+
+            end_slot=min(end_slot,np.searchsorted(network.times,(curr_time//week+1)*week-periodic_boundary_modifier))
+
+            parity=(curr_time//week)%2
+
+            if contact_views[parity] is None:
+
+                contact_views[parity]=presence_view(network,present[parity])
+
+            contacts=contact_views[parity]
+
+        ei,ej,block_offsets,end_slot=contacts.contacts_between(first_slot,end_slot) # all contacts in these slots, as arrays of students
+
+        si=state[ei]
+        sj=state[ej]
+
+        # contacts count (are stored for tracing and can transmit) unless both students are susceptible or either is in quarantine
+        # note: works only for this particular SEIR timeline (incubation time etc)
+
+        both_susceptible=(si==susceptible)&(sj==susceptible)
+        quarantined=in_quarantine[ei]|in_quarantine[ej]
+        counted=~(both_susceptible|quarantined)
+
+        block_exposed=block_exposure_times=None # the exposures of the block, for snapshots
+
+        if infectious>0:
+
+            # transmission is possible from an infectious student to a susceptible one
+
+            i_to_j=counted&is_infectious[ei]&(sj==susceptible)
+            j_to_i=counted&is_infectious[ej]&(si==susceptible)
+
+            candidates=np.flatnonzero(i_to_j|j_to_i)
+
+            sources=np.where(i_to_j[candidates],ei[candidates],ej[candidates])
+            targets=np.where(i_to_j[candidates],ej[candidates],ei[candidates])
+
+            # a draw for each contact (i,j,time), whatever the blocks (sharded networks, weeks, snapshots)
+
+            draws=common_uniforms(transmission_key,ei[candidates],ej[candidates],network.times[first_slot+np.searchsorted(block_offsets,candidates,side='right')-1]+periodic_boundary_modifier)
+
+            hits=draws<p_transmission*dampingfactor[sources]# *mask_factor_out[sources]*mask_factor_in[targets]: # source infects target with this probability
+
+            if hits.any():
+
+                # a student exposed at some contact is no longer susceptible after it,
+                # so only the first successful contact of each target counts
+
+                hit_targets,first_hits=np.unique(targets[hits],return_index=True)
+                first_hits=np.sort(first_hits)
+
+                exposed_at=candidates[hits][first_hits] # index of the contact that exposed each target
+                exposed_targets=targets[hits][first_hits]
+                exposed_slots=first_slot+np.searchsorted(block_offsets,exposed_at,side='right')-1
+
+                if profiling:
+
+                    t_exposure=time()
+
+                for n in xrange(0,len(exposed_targets)):
+
+                    if exposed_slots[n]>=end_slot: # an exposure scheduled an event before this slot, so handle that first
+
+                        break
+
+                    if secondary_only: # infected, but without a timeline: does not infect anyone and schedules no events
+
+                        state[exposed_targets[n]]=state_codes['E']
+
+                        total_infected+=1
+
+                        continue
+
+                    studentlist[exposed_targets[n]].exposure(eventq,int(network.times[exposed_slots[n]])+periodic_boundary_modifier,params) # expose the target and recompute event queue to add disease progression events for target
+
+                    exposed+=1
+                    total_infected+=1
+
+                    next_event=eventq.next_time()
+
+                    if next_event is not None:
+
+                        end_slot=min(end_slot,max(exposed_slots[n]+1,np.searchsorted(network.times,next_event-periodic_boundary_modifier)))
+
+                if profiling:
+
+                    stats['time_exposure']+=time()-t_exposure
+
+                taken=exposed_slots<end_slot # only the exposures that took place
+
+                exposed_at=exposed_at[taken]
+                exposed_targets=exposed_targets[taken]
+
+                if outputs is not None:
+
+                    block_exposed=exposed_targets
+                    block_exposure_times=network.times[exposed_slots[taken]]+periodic_boundary_modifier
+
+                    outputs.transmissions(sources[hits][first_hits][taken],block_exposed,block_exposure_times)
+
+                # contacts of a newly exposed student with susceptibles after the exposure count too
+
+                exposed_index=np.full(N_students,len(ei))
+                exposed_index[exposed_targets]=exposed_at
+
+                contact_index=np.arange(len(ei))
+
+                counted|=both_susceptible&~quarantined&((contact_index>exposed_index[ei])|(contact_index>exposed_index[ej]))
+
+        if profiling:
+
+            stats['ticks']+=int(end_slot-first_slot)
+            stats['blocks']+=1
+            stats['contact_pairs']+=int(block_offsets[end_slot-first_slot])
+
+            t_record=time()
+
+            stats['time_contacts']+=t_record-t_phase
+
+        if snapshotting: # the contacts of the block by period, with the snapshots of the periods that end within it
+
+            outputs.block(population,network.times[first_slot:end_slot]+periodic_boundary_modifier,block_offsets[:end_slot-first_slot+1],ei,ej,block_exposed,block_exposure_times)
+
+        if record_contacts:
+
+            trace.record(first_slot,end_slot,periodic_boundary_modifier,counted[:block_offsets[end_slot-first_slot]],contacts)
+
+        if profiling:
+
+            stats['time_recording']+=time()-t_record
+
+        slot=end_slot
+
+        if slot==len(network.times): # wrap around to the beginning of the data
+
+            slot=0
+            periodic_boundary_modifier+=max_time+300
+
+        # -------------- done looping over contacts at time curr_time
+
+    run.curr_time=curr_time
+    run.slot=slot
+    run.periodic_boundary_modifier=periodic_boundary_modifier
+
+    run.exposed=exposed
+    run.infectious=infectious
+    run.total_infected=total_infected
+    run.quarantines=quarantines
+    run.false_quarantines=false_quarantines
+
+    run.done=done
+
+    return stopped
+
+def SEIR_forked_runs(network,forks,common_rng,p_transmission=0.00625,initial_period_in_days=7,student_ids=None):
+
+    '''Does the runs SEIR_onerun_grid(network,params=fork_params,rng=fork_rng,common_rng=common_rng,p_transmission=p_transmission,
+       initial_period_in_days=initial_period_in_days) for each (fork_params,fork_rng) in forks, with the same results:
+       with common random numbers these runs are the same until the first contact tracing, as the interventions change
+       nothing before it, so that part is simulated once and the runs are forked from a snapshot there (see RunState.fork).
+       The params of the forks may differ only in tracing_params. Returns a list of (total_infected,quarantines,fq), one for each fork'''
+
+    if common_rng is None:
+
+        raise ValueError("Forked runs need common random numbers (common_rng)")
+
+    network=as_network(network,student_ids)
+
+    params=forks[0][0]
+
+    for fork_params,fork_rng in forks:
+
+        if any(not(fork_params[name]==params[name]) for name in params if not(name in tracing_params)):
+
+            raise ValueError("Forked runs can only differ in "+", ".join(tracing_params))
+
+    record_contacts=any(fork_params['p_traced']>0 or fork_params['p_app']>0 for fork_params,fork_rng in forks) # if any of the forks needs them
+
+    run=RunState(network,params,forks[0][1],common_rng,initial_period_in_days,record_contacts)
+
+    if not(advance_run(network,run,params,p_transmission,until_tracing=True)):
+
+        return [run.results()]*len(forks) # over before anyone was traced, so the same in all the runs
+
+    results=[]
+
+    for fork_params,fork_rng in forks:
+
+        forked=run.fork(fork_params,fork_rng)
+
+        advance_run(network,forked,fork_params,p_transmission)
+
+        results.append(forked.results())
+
+    return results
+
+# ---------------- RUN OUTPUTS
+
+# the optional outputs of SEIR_onerun_grid (chain, dailynets, animate) are made as the run goes (see RunOutputs):
+# the transmission chain as (source,target,time) records, and a snapshot at the end of each period of 1/nets_per_day days:
+# the states of the students then and the contacts of the period. They can be collected and returned by the run,
+# or streamed into the logs below (or any function), so that memory use is bounded by one period however many runs
+# are logged. Students are referred to by their dense index in the network (network.ids[index] is the student id).
+# With all outputs off advance_run does no extra work
+
+chain_dtype=np.dtype([('run',np.int64),('source',np.int64),('target',np.int64),('time',np.int64)]) # records of ChainLog; the source of patient zero is -1
+
+edge_dtype=np.dtype([('i',np.int32),('j',np.int32),('weight',np.int32)]) # contacts of a snapshot (i<j), weight = number of time slots with the contact
+
+state_colors=np.array([(0.8,0.8,0.8),(1.0,0.6,0.0)]+[(0.85,0.1,0.1)]*5+[(0.2,0.6,0.2)]) # state_colors[code]: colors of the states in animation frames
+
+class RunLog(object):
+
+    '''Append-only file of the outputs of runs; the runs are numbered in the order they are logged, from first_run on
+       (by default after the last run already in the file, so that the runs of several sessions logged into the same
+       file have different numbers)'''
+
+    def __init__(self,filename,first_run=None):
+
+        self.file=open(filename,'ab')
+
+        self.runs=self.last_run(filename)+1 if first_run is None else first_run
+
+    def last_run(self,filename):
+
+        '''Returns the number of the last run in the log filename, or -1 if there is none'''
+
+        return -1
+
+    def new_run(self):
+
+        '''Returns the number of the next run'''
+
+        self.runs+=1
+
+        return self.runs-1
+
+    def close(self):
+
+        self.file.close()
+
+class ChainLog(RunLog):
+
+    '''Binary log of transmission chains: records of chain_dtype, written as they happen. Pass it as
+       SEIR_onerun_grid(...,chain=log) to all the runs to be logged; read it with read_chains'''
+
+    def last_run(self,filename):
+
+        records=os.path.getsize(filename)//chain_dtype.itemsize
+
+        if records==0:
+
+            return -1
+
+        with open(filename,'rb') as f: # the last record
+
+            f.seek((records-1)*chain_dtype.itemsize)
+
+            return int(np.fromfile(f,dtype=chain_dtype,count=1)['run'][0])
+
+    def write(self,run,sources,targets,times):
+
+        records=np.empty(len(targets),dtype=chain_dtype)
+
+        records['run']=run
+        records['source']=sources
+        records['target']=targets
+        records['time']=times
+
+        records.tofile(self.file)
+
+class SnapshotLog(RunLog):
+
+    '''Log of snapshots, each as consecutive .npy arrays: [run,time], the state codes of the students (int8),
+       in_quarantine (bool) and the contacts of the period (edge_dtype). Pass it as SEIR_onerun_grid(...,dailynets=log)
+       to all the runs to be logged; read it with read_snapshots'''
+
+    def last_run(self,filename):
+
+        run=-1
+
+        with open(filename,'rb') as f: # only the [run,time] arrays are read, the others are skipped
+
+            size=os.fstat(f.fileno()).st_size
+
+            while f.tell()<size:
+
+                run=int(np.load(f)[0])
+
+                for array in xrange(0,3):
+
+                    version=np.lib.format.read_magic(f)
+                    shape,fortran_order,dtype=np.lib.format.read_array_header_1_0(f) if version==(1,0) else np.lib.format.read_array_header_2_0(f)
+
+                    f.seek(int(np.prod(shape))*dtype.itemsize,os.SEEK_CUR)
+
+        return run
+
+    def write(self,run,time,states,in_quarantine,edges):
+
+        np.save(self.file,np.array([run,time],dtype=np.int64))
+        np.save(self.file,states)
+        np.save(self.file,in_quarantine)
+        np.save(self.file,edges)
+
+def read_chains(filename,chunk_records=1000000):
+
+    '''Generator over the runs in a ChainLog file: yields (run,records) for each run, records an array of chain_dtype
+       in time order. The file is read chunk_records records at a time, so only a chunk and one run are in memory'''
+
+    with open(filename,'rb') as f:
+
+        pending=[]
+
+        while True:
+
+            chunk=np.fromfile(f,dtype=chain_dtype,count=chunk_records)
+
+            if len(chunk)==0:
+
+                break
+
+            starts=np.flatnonzero(np.r_[True,chunk['run'][1:]!=chunk['run'][:-1]]).tolist()
+
+            for start,end in zip(starts,starts[1:]+[len(chunk)]):
+
+                if len(pending)>0 and pending[0]['run'][0]!=chunk['run'][start]:
+
+                    yield int(pending[0]['run'][0]),np.concatenate(pending)
+
+                    pending=[]
+
+                pending.append(chunk[start:end])
+
+        if len(pending)>0:
+
+            yield int(pending[0]['run'][0]),np.concatenate(pending)
+
+def read_snapshots(filename):
+
+    '''Generator over the snapshots in a SnapshotLog file: yields (run,time,states,in_quarantine,edges) for each'''
+
+    with open(filename,'rb') as f:
+
+        size=os.fstat(f.fileno()).st_size
+
+        while f.tell()<size:
+
+            run,time=np.load(f).tolist()
+
+            yield run,time,np.load(f),np.load(f),np.load(f)
+
+def offspring_counts(records):
+
+    '''Number of students infected by each infected student of a run, for records of the run as from read_chains
+       (in the order of records); their distribution is that of the individual reproduction numbers'''
+
+    sources=records['source'][records['source']>=0]
+
+    return np.bincount(sources,minlength=records['target'].max()+1)[records['target']]
+
+class RunOutputs(object):
+
+    def __init__(self,network,chain=False,dailynets=False,nets_per_day=8,animate=False,curr_layout=[]):
+
+        '''The optional outputs of a run on network; the arguments as in SEIR_onerun_grid. With chain=True (dailynets=True)
+           the chain (snapshots) are collected into self.chain (self.snapshots), otherwise chain (dailynets) can be a ChainLog
+           (SnapshotLog) or any object with new_run and write like them, to stream into. With animate=True the frames
+           are collected into self.frames, otherwise animate can be a function called with each frame'''
+
+        self.network=network
+
+        self.chain=[] if chain is True else None
+        self.chain_log=chain if not(chain is True) and chain else None
+
+        self.snapshots=[] if dailynets is True else None
+        self.snapshot_log=dailynets if not(dailynets is True) and dailynets else None
+
+        self.frames=[] if animate is True else None
+        self.frame_sink=animate if not(animate is True) and animate else None
+
+        self.snapshotting=bool(dailynets or animate) # advance_run passes its blocks of slots to block
+
+        self.period=int(day/nets_per_day)
+
+        self.layout=None
+        self.figure=None
+
+        if self.frames is not None or self.frame_sink is not None:
+
+            if isinstance(curr_layout,dict): # {student_id:(x,y)}
+
+                self.layout=np.array([curr_layout[student] for student in network.ids],dtype=float)
+
+            elif len(curr_layout)>0: # positions in the order of the dense indices
+
+                self.layout=np.asarray(curr_layout,dtype=float)
+
+            else: # the students on a circle
+
+                angles=2*np.pi*np.arange(network.N_students)/network.N_students
+
+                self.layout=np.column_stack((np.cos(angles),np.sin(angles)))
+
+    def begin(self,patient_zero,start_time):
+
+        '''Starts the outputs of a run where patient_zero is exposed at start_time'''
+
+        if self.chain_log is not None:
+
+            self.chain_run=self.chain_log.new_run()
+
+        if self.snapshot_log is not None:
+
+            self.snapshot_run=self.snapshot_log.new_run()
+
+        self.pending=[] # (node_i,node_j) arrays of the contacts of the current period
+
+        self.next_snapshot=(start_time//self.period+1)*self.period
+
+        self.transmissions(np.array([-1]),np.array([patient_zero]),np.array([start_time]))
+
+    def transmissions(self,sources,targets,times):
+
+        '''Adds the exposures of targets by sources at times to the chain'''
+
+        if self.chain is not None:
+
+            self.chain.extend(zip(sources.tolist(),targets.tolist(),times.tolist()))
+
+        if self.chain_log is not None:
+
+            self.chain_log.write(self.chain_run,sources,targets,times)
+
+    def contacts(self,node_i,node_j):
+
+        '''Adds contacts to those of the current period'''
+
+        self.pending.append((node_i,node_j))
+
+    def block(self,population,slot_times,offsets,node_i,node_j,exposed=None,exposure_times=None):
+
+        '''Adds the contacts of a block of time slots of advance_run (at slot_times; those of slot k at offsets[k]:offsets[k+1]
+           of node_i and node_j), and takes the snapshots of the periods that end within the block. The states only change
+           in a block at its exposures (exposed students, at exposure_times), so the states at the end of a period are
+           those after the block, with the students exposed later still susceptible. The blocks are not split, so that
+           the run is the same as without the snapshots'''
+
+        start=0
+
+        while len(slot_times)>0 and slot_times[-1]>=self.next_snapshot:
+
+            end=offsets[np.searchsorted(slot_times,self.next_snapshot)] # the contacts before the end of the period
+
+            self.contacts(node_i[start:end],node_j[start:end])
+
+            start=end
+
+            self.snapshot(population,None if exposed is None else exposed[exposure_times>=self.next_snapshot])
+
+        self.contacts(node_i[start:offsets[-1]],node_j[start:offsets[-1]])
+
+    def snapshot(self,population,susceptible=None):
+
+        '''Takes the snapshot of the current period, ending at self.next_snapshot, and starts the next one;
+           the students in susceptible (if given) are taken as still susceptible'''
+
+        N_students=self.network.N_students
+
+        if len(self.pending)>0:
+
+            node_i=np.concatenate([pair[0] for pair in self.pending]).astype(np.int64)
+            node_j=np.concatenate([pair[1] for pair in self.pending]).astype(np.int64)
+
+            pairs,weights=np.unique(np.minimum(node_i,node_j)*N_students+np.maximum(node_i,node_j),return_counts=True)
+
+        else:
+
+            pairs,weights=np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64)
+
+        self.pending=[]
+
+        edges=np.empty(len(pairs),dtype=edge_dtype)
+
+        edges['i']=pairs//N_students
+        edges['j']=pairs%N_students
+        edges['weight']=weights
+
+        time=self.next_snapshot
+
+        states=population.state.astype(np.int8)
+        in_quarantine=population.in_quarantine.copy()
+
+        if susceptible is not None:
+
+            states[susceptible]=state_codes['S']
+
+        if self.snapshots is not None:
+
+            self.snapshots.append((time,states,in_quarantine,edges))
+
+        if self.snapshot_log is not None:
+
+            self.snapshot_log.write(self.snapshot_run,time,states,in_quarantine,edges)
+
+        if self.frames is not None or self.frame_sink is not None:
+
+            frame=self.frame(time,states,in_quarantine,edges)
+
+            if self.frames is not None:
+
+                self.frames.append(frame)
+
+            else:
+
+                self.frame_sink(frame)
+
+        self.next_snapshot+=self.period
+
+    def frame(self,time,states,in_quarantine,edges):
+
+        '''Draws a snapshot: the students at their positions in self.layout colored by state (quarantined ones circled),
+           and the contacts of the period. Returns the image as an array of RGB rows, as for moviepy.editor.ImageSequenceClip'''
+
+        if self.figure is None:
+
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+            self.figure=Figure(figsize=(6,6),dpi=80)
+            self.canvas=FigureCanvasAgg(self.figure)
+
+        self.figure.clf()
+
+        axes=self.figure.add_axes([0,0,1,1])
+        axes.axis('off')
+
+        if len(edges)>0:
+
+            from matplotlib.collections import LineCollection
+
+            axes.add_collection(LineCollection(np.stack((self.layout[edges['i']],self.layout[edges['j']]),axis=1),colors='0.6',linewidths=0.3))
+
+        axes.scatter(self.layout[:,0],self.layout[:,1],s=15,c=state_colors[states],edgecolors='k',linewidths=1.5*in_quarantine)
+
+        axes.text(0.02,0.98,'day %.2f' % (float(time)/day),transform=axes.transAxes,va='top')
+
+        self.canvas.draw()
+
+        width,height=self.canvas.get_width_height()
+
+        return np.frombuffer(self.canvas.tostring_rgb(),dtype=np.uint8).reshape(height,width,3).copy()
+
+# ---------------- REPRODUCTION NUMBER
+
+# the reproduction number R is the number of students infected by one infectious student. With R0=True, SEIR_onerun_grid
+# lets only patient zero infect: the students it infects are counted, but get no timeline, so the run ends when patient zero
+# recovers. secondary_cases does the same for many index cases at once without the run loop: the timelines of all index
+# cases are drawn with numpy, and their contacts while infectious and not in quarantine are looked up in an index of the
+# contacts of each student (see student_contacts; a shard at a time for a ShardedContactNetwork, see student_contact_blocks)
+# and drawn from together. As only the index cases' own infectious periods
+# are simulated, this costs a small fraction of the runs of a sweep. Contact tracing (p_traced, p_app and the other
+# tracing_params) only quarantines the contacts of an index case, so it does not change R; testing, quarantine and
+# interleaving (oddweeks) do
+
+def _timesteps(times): # rounds times (an array) to time steps of the data, as the timelines of Node.exposure
+
+    return (timestep_in_data*np.round(np.asarray(times,dtype=float)/timestep_in_data)).astype(np.int64)
+
+def _student_contacts(network,first_slot,end_slot): # (keys,partners) of student_contacts for the slots first_slot..end_slot-1
+
+    period=network.max_time+300 # data time is less than this, so keys sort by student and then time
+
+    keys=[]
+    partners=[]
+
+    slot=first_slot
+
+    while slot<end_slot:
+
+        ei,ej,offsets,slot_end=network.contacts_between(slot,end_slot)
+
+        times=np.repeat(network.times[slot:slot_end],np.diff(offsets))
+
+        keys.append(np.concatenate((ei,ej)).astype(np.int64)*period+np.concatenate((times,times)))
+        partners.append(np.concatenate((ej,ei)))
+
+        slot=slot_end
+
+    keys=np.concatenate(keys) if keys else np.zeros(0,dtype=np.int64)
+    partners=np.concatenate(partners) if partners else np.zeros(0,dtype=np.int32)
+
+    order=np.argsort(keys,kind='mergesort')
+
+    return keys[order],partners[order]
+
+def student_contacts(network):
+
+    '''Returns (keys,partners), all contacts of each student: keys=student*(network.max_time+300)+time in order, partners
+       the other student of each contact (both ways of each contact). Made once for a ContactNetwork and kept in it;
+       a ShardedContactNetwork is not indexed as a whole, as it does not fit in memory (see student_contact_blocks)'''
+
+    if not(isinstance(network,ContactNetwork)):
+
+        raise ValueError("student_contacts needs a ContactNetwork; index a ShardedContactNetwork a shard at a time with student_contact_blocks")
+
+    if network.student_contacts is None:
+
+        network.student_contacts=_student_contacts(network,0,len(network.times))
+
+    return network.student_contacts
+
+def student_contact_blocks(network):
+
+    '''Yields (keys,partners) as student_contacts for parts of the network that together hold all its contacts:
+       the whole network for a ContactNetwork, and one shard at a time (made when needed, and not kept) for a
+       ShardedContactNetwork, so only one shard of contacts is indexed in memory at a time'''
+
+    if isinstance(network,ContactNetwork):
+
+        yield student_contacts(network)
+
+        return
+
+    slot_ends=list(network.shard_first_slot[1:])+[len(network.times)]
+
+    for first_slot,end_slot in zip(network.shard_first_slot,slot_ends):
+
+        yield _student_contacts(network,first_slot,end_slot)
+
+def secondary_cases(network,params=default_intervention_params,p_transmission=0.00625,index_cases=1000,initial_period_in_days=7,rng=None,start_times=None,chunk_size=10000,student_ids=None):
+
+    '''Draws index cases and the students each of them infects (see SEIR_onerun_grid with R0=True), chunk_size index cases
+       at a time. index_cases is the number of index cases, drawn as patient zero of a run (a random student, exposed at its
+       first contact + 0-initial_period_in_days days), or an array of students (e.g. np.arange(network.N_students) for each
+       student once), exposed at start_times (by default drawn as for patient zero). rng as in SEIR_onerun_grid.
+       Returns secondary,expected: for each index case the number of students it infected, and the expected number given
+       the timeline of the index case (with the same mean as secondary, but less noisy). A ShardedContactNetwork gives
+       the same results, but its shards are indexed again for each chunk of index cases (see student_contact_blocks)'''
+
+    network=as_network(network,student_ids)
+
+    rng=make_rng(rng)
+
+    N_students=network.N_students
+
+    period=network.max_time+300
+
+    if np.ndim(index_cases)==0:
+
+        students=rng.choice(N_students,size=index_cases)
+
+    else:
+
+        students=np.asarray(index_cases,dtype=np.int64)
+
+    if start_times is None:
+
+        start_times=network.first_times[students]+_timesteps(day*rng.uniform(size=len(students))*initial_period_in_days)
+
+    start_times=np.asarray(start_times,dtype=np.int64)
+
+    secondary=np.zeros(len(students),dtype=np.int64)
+    expected=np.zeros(len(students))
+
+    never=np.iinfo(np.int64).max
+
+    for first in xrange(0,len(students),chunk_size):
+
+        index=students[first:first+chunk_size]
+
+        K=len(index)
+
+        # the timelines of the index cases, as in Node.exposure
+
+        z=rng.normal(size=(K,4))
+        u=rng.uniform(size=(K,2))
+
+        time_to_ip=_timesteps(start_times[first:first+K]+latency_period+z[:,0]*latency_period/10.0)
+        time_to_i=_timesteps(time_to_ip+prodromal_period+z[:,1]*prodromal_period/10.0)
+
+        Iclass=np.minimum(np.searchsorted(I_cumprobs,u[:,0],side='right'),len(I_classes)-1)
+
+        infectiousness=p_transmission*np.where(Iclass==I_classes.index('Iss'),1.0,0.5)
+
+        tested=(Iclass==I_classes.index('Iss'))|((Iclass!=I_classes.index('Ias'))&(u[:,1]<params['p_tested']))
+
+        time_to_testing=np.where(tested,_timesteps(time_to_i+params['test_delay']+z[:,2]*params['test_delay']/10.0),never)
+        time_to_eoq=np.where(tested,_timesteps(np.where(tested,time_to_testing,0)+params['quarantine_length']),never)
+
+        time_to_r=_timesteps(time_to_i+infectious_period+z[:,3]*infectious_period/10.0)
+
+        # infectious and not in quarantine from Ip until testing, and after the quarantine until recovery (events are
+        # handled before the contacts of a time slot, so a window includes its first time slot and not its last)
+
+        cases=np.concatenate((np.arange(K),np.arange(K)))
+        window_start=np.concatenate((time_to_ip,np.minimum(time_to_eoq,time_to_r)))
+        window_end=np.concatenate((np.minimum(time_to_r,time_to_testing),time_to_r))
+
+        # the contacts of the index cases in these windows, in each block of the index; the data repeats every period,
+        # so a window is split at the ends of periods
+
+        contact_cases=[]
+        contact_partners=[]
+        contact_times=[]
+
+        for keys,partners in student_contact_blocks(network):
+
+            open_cases,open_start,open_end=cases,window_start,window_end
+
+            while True:
+
+                open_windows=np.flatnonzero(open_start<open_end)
+
+                if len(open_windows)==0:
+
+                    break
+
+                open_cases,open_start,open_end=open_cases[open_windows],open_start[open_windows],open_end[open_windows]
+
+                repeat=open_start//period
+                segment_end=np.minimum(open_end,(repeat+1)*period)
+
+                lo=np.searchsorted(keys,index[open_cases]*period+open_start-repeat*period)
+                hi=np.searchsorted(keys,index[open_cases]*period+segment_end-repeat*period)
+
+                counts=hi-lo
+
+                found=np.arange(counts.sum())+np.repeat(lo-(np.cumsum(counts)-counts),counts) # positions of the contacts in keys
+
+                contact_cases.append(np.repeat(open_cases,counts))
+                contact_partners.append(partners[found])
+                contact_times.append(keys[found]-np.repeat(index[open_cases]*period-repeat*period,counts))
+
+                open_start=segment_end
+
+        # in order of case, time and partner, so that the draws do not depend on the blocks of the index
+
+        contact_cases=np.concatenate(contact_cases)
+        contact_partners=np.concatenate(contact_partners).astype(np.int64)
+        contact_times=np.concatenate(contact_times)
+
+        order=np.lexsort((contact_partners,contact_times,contact_cases))
+
+        contact_cases,contact_partners,contact_times=contact_cases[order],contact_partners[order],contact_times[order]
+
+        if params['oddweeks']: # only the contacts when both are present
+
+            # the weeks of the students for each index case, as a hash of (case,student), only for the students met
+
+            week_key=np.uint64(random_integer(rng,2**63-1))
+
+            parity=(contact_times//week)%2==1
+            no_time=np.zeros(len(contact_cases),dtype=np.int64)
+
+            present=(common_uniforms(week_key,contact_cases,index[contact_cases],no_time)>=0.5)==parity
+            present&=(common_uniforms(week_key,contact_cases,contact_partners,no_time)>=0.5)==parity
+
+            contact_cases,contact_partners=contact_cases[present],contact_partners[present]
+
+        # a partner is infected if any of its contacts with the index case transmits
+
+        pairs,contacts=np.unique(contact_cases*N_students+contact_partners,return_counts=True)
+
+        expected[first:first+K]=np.bincount(pairs//N_students,weights=1.0-(1.0-infectiousness[pairs//N_students])**contacts,minlength=K)
+
+        hits=rng.uniform(size=len(contact_cases))<infectiousness[contact_cases]
+
+        infected=np.unique(contact_cases[hits]*N_students+contact_partners[hits])
+
+        secondary[first:first+K]=np.bincount(infected//N_students,minlength=K)
+
+    return secondary,expected
+
+def R_grid(network,params=default_intervention_params,grid=[('p_tested',[0.0,0.5,1.0])],index_cases=10000,run_kwargs={},seed=None):
+
+    '''Estimates R at each point of grid (see sweep_grid) with secondary_cases(network,params,index_cases=index_cases,**run_kwargs)
+       and the swept values; all points have the same index cases and timelines (from seed), so that they can be compared
+       with little noise. Returns a list of (point,R,standard error), point the values of the swept parameters'''
+
+    grid=sweep_grid(grid)
+
+    if seed is None:
+
+        seed=int(np.random.randint(0,2**31-1))
+
+    estimates=[]
+
+    for point in itertools.product(*[values for name,values in grid]):
+
+        point_params=dict(params)
+        kwargs=dict(run_kwargs)
+
+        for (name,values),value in zip(grid,point):
+
+            if name in sweep_kwargs:
+
+                kwargs[name]=value
+
+            else:
+
+                point_params[name]=value
+
+        secondary,expected=secondary_cases(network,point_params,index_cases=index_cases,rng=seed,**kwargs)
+
+        estimates.append((point,expected.mean(),expected.std(ddof=1)/np.sqrt(len(expected))))
+
+    return estimates
+
+# ---------------- COMPILED BACKEND
+
+# SEIR_onerun_grid(...,backend='compiled') does the run with the kernel below, compiled with numba if it is installed
+# (otherwise the python backend is used). The kernel is the same model flattened into typed arrays:
+# state codes in arrays, the event queue as a binary heap in an array of (time,n,student,event code) rows,
+# and the contacts recorded for tracing in one log of (time,student_i,student_j) in time order, searched when tracing.
+# Contacts are handled one by one, with the states at the time of the contact; random numbers come from numba's
+# generator, seeded from the run's rng. So the runs are not the same as with the python backend, but the model is
+# (see compare_backends).
+
+backends=['python','compiled']
+
+def _compiled(function): # compiled with numba if it is installed; otherwise the backend is not used
+
+    if numba is None:
+
+        return function
+
+    return numba.njit(cache=True)(function)
+
+@_compiled
+def _heap_push(heap,size,time,n,student,event):
+
+    '''Adds the event (time,n,student,event code) to heap (an array with size events in heap order); returns heap, which is
+       a larger copy if it was full. Events are ordered by time and then n'''
+
+    if size==heap.shape[0]:
+
+        grown=np.empty((2*heap.shape[0],4),dtype=np.int64)
+        grown[:size]=heap[:size]
+
+        heap=grown
+
+    k=size
+
+    while k>0:
+
+        parent=(k-1)//2
+
+        if heap[parent,0]<time or (heap[parent,0]==time and heap[parent,1]<n):
+
+            break
+
+        for column in range(4):
+
+            heap[k,column]=heap[parent,column]
+
+        k=parent
+
+    heap[k,0]=time
+    heap[k,1]=n
+    heap[k,2]=student
+    heap[k,3]=event
+
+    return heap
+
+@_compiled
+def _heap_pop(heap,size):
+
+    '''Removes the earliest event from heap (size events before removing it); returns its student and event code'''
+
+    student=heap[0,2]
+    event=heap[0,3]
+
+    size-=1
+
+    time,n,last_student,last_event=heap[size,0],heap[size,1],heap[size,2],heap[size,3]
+
+    k=0
+
+    while True:
+
+        child=2*k+1
+
+        if child>=size:
+
+            break
+
+        if child+1<size and (heap[child+1,0]<heap[child,0] or (heap[child+1,0]==heap[child,0] and heap[child+1,1]<heap[child,1])):
+
+            child+=1
+
+        if heap[child,0]>time or (heap[child,0]==time and heap[child,1]>n):
+
+            break
+
+        for column in range(4):
+
+            heap[k,column]=heap[child,column]
+
+        k=child
+
+    heap[k,0]=time
+    heap[k,1]=n
+    heap[k,2]=last_student
+    heap[k,3]=last_event
+
+    return student,event
+
+@_compiled
+def _to_timestep(time,timestep): # rounds time to a multiple of timestep (like int(timestep*round(time/timestep)))
+
+    return np.int64(timestep*np.floor(time/timestep+0.5))
+
+@_compiled
+def _kernel_exposure(student,curr_time,state,dampingfactor,in_quarantine,heap,size,n_added,codes,I_cumprobs,I_codes,
+                     latency,prodromal,infectious_period,timestep,p_tested,test_delay):
+
+    '''Node.exposure: sets student to E and adds the events of its timeline to heap; returns heap,size,n_added'''
+
+    state[student]=codes[1]
+
+    z_ip=np.random.normal(0.0,1.0)
+    z_i=np.random.normal(0.0,1.0)
+    z_test=np.random.normal(0.0,1.0)
+    z_r=np.random.normal(0.0,1.0)
+    u_class=np.random.random()
+    u_test=np.random.random()
+
+    time_to_ip=_to_timestep(curr_time+latency+z_ip*latency/10.0,timestep)
+
+    heap=_heap_push(heap,size,time_to_ip,n_added,student,codes[7])
+    size+=1
+    n_added+=1
+
+    time_to_i=_to_timestep(time_to_ip+prodromal+z_i*prodromal/10.0,timestep)
+
+    Iclass=min(np.searchsorted(I_cumprobs,u_class,side='right'),len(I_codes)-1) # Ias,Ips,Ims,Iss
+
+    heap=_heap_push(heap,size,time_to_i,n_added,student,I_codes[Iclass])
+    size+=1
+    n_added+=1
+
+    if Iclass==3:
+
+        dampingfactor[student]=1.0
+
+    else:
+
+        dampingfactor[student]=0.5
+
+    if Iclass>0:
+
+        if Iclass==3 or u_test<p_tested:
+
+            time_to_testing=_to_timestep(time_to_i+test_delay+z_test*test_delay/10.0,timestep)
+
+            if not(in_quarantine[student]):
+
+                heap=_heap_push(heap,size,time_to_testing,n_added,student,codes[3])
+                size+=1
+                n_added+=1
+
+            heap=_heap_push(heap,size,time_to_testing+np.int64(timestep),n_added,student,codes[6])
+            size+=1
+            n_added+=1
+
+    time_to_r=_to_timestep(time_to_i+infectious_period+z_r*infectious_period/10.0,timestep)
+
+    heap=_heap_push(heap,size,time_to_r,n_added,student,codes[2])
+    size+=1
+    n_added+=1
+
+    return heap,size,n_added
+
+@_compiled
+def _kernel_run(times,offsets,node_i,node_j,max_time,has_app,oddweek,week,patient_zero,start_time,record_contacts,seed,codes,infectious_codes,I_cumprobs,I_codes,
+                latency,prodromal,infectious_period,timestep,p_transmission,p_tested,test_delay,quarantine_length,
+                tracelength,p_traced,manual_tracing_threshold,app_tracing_threshold,trace_delay_manual,trace_delay_app):
+
+    '''The run loop of SEIR_onerun_grid on the arrays of a ContactNetwork (see compiled_run).
+       codes are the codes of S,E,R,BOQ,BOQ_t,EOQ,CT,Ip; infectious_codes[code] is True for infectious states;
+       I_codes are the codes of I_classes; oddweek[student] is the parity of the weeks the student is present, or -1 if always.
+       Returns total_infected,quarantines,false_quarantines'''
+
+    np.random.seed(seed)
+
+    N_students=len(has_app)
+
+    susceptible,recovered,boq,traced_quarantine,eoq,contact_tracing=codes[0],codes[2],codes[3],codes[4],codes[5],codes[6]
+
+    state=np.zeros(N_students,dtype=np.int8)
+    is_infectious=np.zeros(N_students,dtype=np.bool_)
+    dampingfactor=np.ones(N_students)
+    in_quarantine=np.zeros(N_students,dtype=np.bool_)
+
+    heap=np.empty((64,4),dtype=np.int64)
+    size=0
+    n_added=0
+
+    # contacts recorded for tracing; entries before the last tracelength are dropped when the log is full
+
+    log_times=np.empty(4096,dtype=np.int64)
+    log_i=np.empty(4096,dtype=np.int64)
+    log_j=np.empty(4096,dtype=np.int64)
+    log_size=0
+
+    partner_counts=np.zeros(N_students,dtype=np.int64) # for tracing
+    partners=np.empty(N_students,dtype=np.int64)
+
+    curr_time=start_time
+
+    heap,size,n_added=_kernel_exposure(patient_zero,curr_time,state,dampingfactor,in_quarantine,heap,size,n_added,codes,I_cumprobs,I_codes,
+                                       latency,prodromal,infectious_period,timestep,p_tested,test_delay)
+
+    exposed=1
+    infectious=0
+    total_infected=1
+    quarantines=0
+    false_quarantines=0
+
+    periodic_boundary_modifier=0
+
+    while (curr_time-periodic_boundary_modifier)>max_time:
+
+        periodic_boundary_modifier+=max_time+300
+
+    slot=np.searchsorted(times,curr_time-periodic_boundary_modifier)
+
+    while True:
+
+        contact_time=times[slot]+periodic_boundary_modifier
+
+        # --------- events at a time slot are handled before its contacts
+
+        if size>0 and heap[0,0]<=contact_time:
+
+            curr_time=heap[0,0]
+
+            while size>0 and heap[0,0]==curr_time:
+
+                student,event=_heap_pop(heap,size)
+                size-=1
+
+                if event==traced_quarantine and not(in_quarantine[student]):
+
+                    quarantines+=1
+
+                    if state[student]==susceptible or state[student]==recovered:
+
+                        false_quarantines+=1
+
+                elif event==recovered:
+
+                    infectious-=1
+
+                elif event<len(infectious_codes) and infectious_codes[event]:
+
+                    exposed-=1
+                    infectious+=1
+
+                # Node.statechange
+
+                if event==eoq:
+
+                    in_quarantine[student]=False
+
+                elif event==boq or event==traced_quarantine:
+
+                    if not(in_quarantine[student]):
+
+                        heap=_heap_push(heap,size,_to_timestep(curr_time+quarantine_length,timestep),n_added,student,eoq)
+                        size+=1
+                        n_added+=1
+
+                        in_quarantine[student]=True
+
+                elif event==contact_tracing: # ContactTrace.trace: the partners within tracelength, and the number of time slots with each
+
+                    n_partners=0
+
+                    for k in range(np.searchsorted(log_times[:log_size],curr_time-tracelength),log_size):
+
+                        if log_i[k]==student:
+
+                            partner=log_j[k]
+
+                        elif log_j[k]==student:
+
+                            partner=log_i[k]
+
+                        else:
+
+                            continue
+
+                        if partner_counts[partner]==0:
+
+                            partners[n_partners]=partner
+                            n_partners+=1
+
+                        partner_counts[partner]+=1
+
+                    for n in range(n_partners): # Node.quarantine_contacts
+
+                        partner=partners[n]
+                        count=partner_counts[partner]
+
+                        partner_counts[partner]=0
+
+                        recalled=np.random.random()<p_traced
+                        z_delay=np.random.normal(0.0,1.0)
+
+                        put_in_quarantine=False
+                        quarantine_time=np.int64(0)
+
+                        if count>manual_tracing_threshold and recalled:
+
+                            put_in_quarantine=True
+                            quarantine_time=_to_timestep(curr_time+trace_delay_manual+z_delay*trace_delay_manual/10.0,timestep)
+
+                        if has_app[student] and has_app[partner] and count>app_tracing_threshold and not(put_in_quarantine):
+
+                            put_in_quarantine=True
+                            quarantine_time=_to_timestep(curr_time+trace_delay_app+z_delay*trace_delay_app/10.0,timestep)
+
+                        if put_in_quarantine:
+
+                            heap=_heap_push(heap,size,quarantine_time,n_added,partner,traced_quarantine)
+                            size+=1
+                            n_added+=1
+
+                else:
+
+                    state[student]=event
+                    is_infectious[student]=infectious_codes[event]
+
+            continue
+
+        curr_time=contact_time
+
+        if (exposed+infectious)==0: # done when no-one is infectious or exposed
+
+            break
+
+        # --------- transmission and recording of the contacts of the slot
+
+        parity=(curr_time//week)%2
+
+        for k in range(offsets[slot],offsets[slot+1]):
+
+            i=node_i[k]
+            j=node_j[k]
+
+            if (oddweek[i]>=0 and oddweek[i]!=parity) or (oddweek[j]>=0 and oddweek[j]!=parity): # not present this week
+
+                continue
+
+            if in_quarantine[i] or in_quarantine[j] or (state[i]==susceptible and state[j]==susceptible):
+
+                continue
+
+            if is_infectious[i] and state[j]==susceptible:
+
+                source=i
+                target=j
+
+            elif is_infectious[j] and state[i]==susceptible:
+
+                source=j
+                target=i
+
+            else:
+
+                source=-1
+                target=-1
+
+            if source>=0 and np.random.random()<p_transmission*dampingfactor[source]:
+
+                heap,size,n_added=_kernel_exposure(target,curr_time,state,dampingfactor,in_quarantine,heap,size,n_added,codes,I_cumprobs,I_codes,
+                                                   latency,prodromal,infectious_period,timestep,p_tested,test_delay)
+
+                exposed+=1
+                total_infected+=1
+
+            if record_contacts:
+
+                if log_size==len(log_times): # drop the contacts older than tracelength, and make room
+
+                    first=np.searchsorted(log_times[:log_size],curr_time-tracelength)
+
+                    capacity=len(log_times) if 2*(log_size-first)<len(log_times) else 2*len(log_times)
+
+                    new_times=np.empty(capacity,dtype=np.int64)
+                    new_i=np.empty(capacity,dtype=np.int64)
+                    new_j=np.empty(capacity,dtype=np.int64)
+
+                    new_times[:log_size-first]=log_times[first:log_size]
+                    new_i[:log_size-first]=log_i[first:log_size]
+                    new_j[:log_size-first]=log_j[first:log_size]
+
+                    log_times,log_i,log_j=new_times,new_i,new_j
+                    log_size-=first
+
+                log_times[log_size]=curr_time
+                log_i[log_size]=i
+                log_j[log_size]=j
+                log_size+=1
+
+        slot+=1
+
+        if slot==len(times): # wrap around to the beginning of the data
+
+            slot=0
+            periodic_boundary_modifier+=max_time+300
+
+    return total_infected,quarantines,false_quarantines
+
+def compiled_run(network,params=default_intervention_params,p_transmission=0.00625,initial_period_in_days=7,rng=None):
+
+    '''Does one run of the SEIR model with the compiled kernel (see SEIR_onerun_grid with backend='compiled');
+       network must be a ContactNetwork. Returns total_infected,quarantines,fq'''
+
+    rng=make_rng(rng)
+
+    N_students=network.N_students
+
+    draws=rng.uniform(size=(3,N_students)) # the student properties, as in Population
+
+    has_app=draws[2]<params['p_app']
+
+    oddweek=np.where(draws[0]>=0.5,1,0) if params['oddweeks'] else np.full(N_students,-1)
+
+    patient_zero=rng.choice(N_students)
+
+    start_time=int(network.first_times[patient_zero])+int(timestep_in_data*round((day*rng.uniform()*initial_period_in_days)/timestep_in_data))
+
+    record_contacts=params['p_traced']>0 or has_app.any()
+
+    codes=np.array([state_codes['S'],state_codes['E'],state_codes['R'],event_codes['BOQ'],event_codes['BOQ_t'],event_codes['EOQ'],event_codes['CT'],state_codes['Ip']],dtype=np.int64)
+
+    total_infected,quarantines,false_quarantines=_kernel_run(network.times,network.offsets,network.node_i,network.node_j,network.max_time,has_app,
+                                                             oddweek.astype(np.int64),week,
+                                                             int(patient_zero),start_time,bool(record_contacts),random_integer(rng,2**31-1),
+                                                             codes,np.array(infectious_states),np.array(I_cumprobs,dtype=float),
+                                                             np.array([state_codes[Iclass] for Iclass in I_classes],dtype=np.int64),
+                                                             float(latency_period),float(prodromal_period),float(infectious_period),float(timestep_in_data),
+                                                             float(p_transmission),float(params['p_tested']),float(params['test_delay']),float(params['quarantine_length']),
+                                                             float(params['tracelength']),float(params['p_traced']),float(params['manual_tracing_threshold']),
+                                                             float(params['app_tracing_threshold']),float(params['trace_delay_manual']),float(params['trace_delay_app']))
+
+    if quarantines>0:
+
+        fq=float(false_quarantines)/quarantines
+
+    else:
+
+        fq=0.0
+
+    return int(total_infected),int(quarantines),fq
+
+def compare_backends(network,params=default_intervention_params,runs=200,p_transmission=0.00625,seed=0):
+
+    '''Cross-validates the backends of SEIR_onerun_grid: does runs runs with each and compares the distributions of
+       each result (see result_names). Returns a dictionary result name:(mean with python, mean with compiled,
+       Kolmogorov-Smirnov statistic, its p-value); a small p-value means that the backends disagree'''
+
+    from scipy.stats import ks_2samp
+
+    results={}
+
+    for backend in backends:
+
+        results[backend]=np.array([SEIR_onerun_grid(network,params=params,p_transmission=p_transmission,rng=[seed,run],backend=backend) for run in xrange(0,runs)],dtype=float)
+
+    comparison={}
+
+    for k,name in enumerate(result_names):
+
+        statistic,p_value=ks_2samp(results['python'][:,k],results['compiled'][:,k])
+
+        comparison[name]=(results['python'][:,k].mean(),results['compiled'][:,k].mean(),statistic,p_value)
+
+    return comparison
+
+# ---------------- BATCHES OF RUNS
+
+# SEIR_batch_runs advances several independent runs (replicates) of the same model at once over the same contact slots:
+# the states of all replicates are (replicates x N_students) arrays, and the contacts of each block of slots are handled
+# for all replicates with the same numpy operations. Each replicate has its own random number generator (and so its own
+# patient zero, apps and masks, and disease timelines), event queue and Nodes; blocks end at the next event of any replicate.
+# The transmissions of all replicates are drawn at once with common_uniforms, each with the key of its replicate.
+# The contacts recorded for tracing are kept in one ContactTrace with a row for each replicate, as for the run of advance_run.
+
+def SEIR_batch_runs(network,seeds,params=default_intervention_params,p_transmission=0.00625,initial_period_in_days=7,student_ids=None,common_seeds=None):
+
+    '''Does len(seeds) runs of the SEIR model at once, as SEIR_onerun_grid(network,params=params,p_transmission=p_transmission,
+       initial_period_in_days=initial_period_in_days,rng=seed) would for each seed in seeds, with the same results
+       (the results of a replicate only depend on its seed, not on the other replicates of the batch).
+       With common_seeds (one for each seed), replicate r uses common random numbers with common_rng=common_seeds[r]
+       (see Population).
+       Returns a list of (total_infected,quarantines,fq), one for each seed'''
+
+    network=as_network(network,student_ids)
+
+    N_students=network.N_students
+
+    max_time=network.max_time
+
+    replicates=len(seeds)
+
+    # states of all replicates; row r is the state array of the Population of replicate r
+
+    state=np.zeros((replicates,N_students),dtype=np.int8)
+    is_infectious=np.zeros((replicates,N_students),dtype=bool)
+    dampingfactor=np.ones((replicates,N_students),dtype=float)
+    in_quarantine=np.zeros((replicates,N_students),dtype=bool)
+    oddweek=np.zeros((replicates,N_students),dtype=np.int8) # the weeks each student is present with the interleaving intervention
+
+    rngs=[]
+    studentlists=[]
+    apps=[]
+    eventqs=[]
+    patient_zeros=[]
+    transmission_keys=[]
+
+    start_times=np.zeros(replicates)
+
+    for r in xrange(0,replicates):
+
+        population=Population(N_students,params,seeds[r],None if common_seeds is None else common_seeds[r])
+
+        population.state=state[r]
+        population.infectious=is_infectious[r]
+        population.dampingfactor=dampingfactor[r]
+        population.in_quarantine=in_quarantine[r]
+
+        rng=population.rng
+
+        patient_zeros.append(population.common_rng.choice(N_students))
+
+        studentlists.append([Node(params=params,myid=sid,currtime=0,population=population) for sid in xrange(0,N_students)])
+
+        apps.append(set(np.flatnonzero(population.has_app).tolist()))
+
+        oddweek[r]=population.oddweek
+
+        eventqs.append(EventQueue())
+
+        rngs.append(rng)
+
+        # patient zero is exposed at its first contact + 0-7 days, when the replicate starts
+
+        start_time=int(network.first_times[patient_zeros[r]])
+
+        start_times[r]=start_time+int(timestep_in_data*round((day*population.common_rng.uniform()*initial_period_in_days)/timestep_in_data))
+
+        transmission_keys.append(population.transmission_key)
+
+    transmission_keys=np.array(transmission_keys,dtype=np.uint64)
+
+    susceptible=state_codes['S']
+    recovered=state_codes['R']
+    traced_quarantine=event_codes['BOQ_t']
+    contact_tracing=event_codes['CT']
+
+    record_contacts=np.array([params['p_traced']>0 or len(apps[r])>0 for r in xrange(0,replicates)]) # contacts are only needed if they can be traced
+
+    trace=ContactTrace(network,params['tracelength'],rows=replicates) # the contacts recorded for tracing, a row for each replicate
+
+    # book-keeping of each replicate (see SEIR_onerun_grid)
+
+    exposed=np.zeros(replicates,dtype=int)
+    infectious=np.zeros(replicates,dtype=int)
+    total_infected=[0]*replicates
+    quarantines=[0]*replicates
+    false_quarantines=[0]*replicates
+
+    started=np.zeros(replicates,dtype=bool)
+    active=np.ones(replicates,dtype=bool)        # replicates not done yet
+
+    next_event=start_times.copy()                  # time of the next event of each replicate (its start, until it has started)
+
+    curr_time=int(start_times.min())
+
+    periodic_boundary_modifier=0
+
+    while (curr_time-periodic_boundary_modifier)>max_time:
+
+        periodic_boundary_modifier+=max_time+300
+
+    slot=np.searchsorted(network.times,curr_time-periodic_boundary_modifier)
+
+    while active.any():
+
+        contact_time=int(network.times[slot])+periodic_boundary_modifier
+        event_time=next_event[active].min()
+
+        # --------- handle the events of the replicates with the earliest events; events at a time slot are handled before its contacts
+
+        if event_time<=contact_time:
+
+            curr_time=int(event_time)
+
+            for r in np.flatnonzero(active&(next_event==event_time)).tolist():
+
+                if not(started[r]):
+
+                    studentlists[r][patient_zeros[r]].exposure(eventqs[r],curr_time,params) # now expose patient zero
+
+                    started[r]=True
+
+                    exposed[r]=1
+                    total_infected[r]=1
+
+                studentlist=studentlists[r]
+
+                for student,event in eventqs[r].pop_events(curr_time):
+
+                    if event==traced_quarantine and not(in_quarantine[r,student]):
+
+                        quarantines[r]+=1
+
+                        if state[r,student]==susceptible or state[r,student]==recovered:
+
+                            false_quarantines[r]+=1
+
+                    elif event==recovered:
+
+                        infectious[r]-=1
+
+                    elif event<len(infectious_states) and infectious_states[event]:
+
+                        exposed[r]-=1
+                        infectious[r]+=1
+
+                    elif event==contact_tracing: # traced from the recorded contacts of the replicate
+
+                        contacts,scanned=trace.trace(student,curr_time,r)
+
+                        studentlist[student].quarantine_contacts(contacts,eventqs[r],curr_time,params,apps[r])
+
+                        continue
+
+                    studentlist[student].statechange(eventqs[r],event,curr_time,params,apps[r])
+
+                next_time=eventqs[r].next_time()
+
+                next_event[r]=np.inf if next_time is None else next_time
+
+            continue
+
+        curr_time=contact_time
+
+        active&=~(started&((exposed+infectious)==0)) # a replicate is done when no-one is infectious or exposed
+
+        if not(active.any()):
+
+            break
+
+        # --------- handle transmission and contacts of the running replicates, in all slots up to the next event of any replicate
+
+        first_slot=slot
+
+        event_time=next_event[active].min()
+
+        if event_time==np.inf:
+
+            end_slot=len(network.times)
+
+        else:
+
+            end_slot=np.searchsorted(network.times,int(event_time)-periodic_boundary_modifier) # (an int: searching for a float would convert all times)
+
+        if params['oddweeks']: # blocks end with the week, as the students present change weekly
+
+            end_slot=min(end_slot,np.searchsorted(network.times,(curr_time//week+1)*week-periodic_boundary_modifier))
+
+        # only the replicates where someone is infectious (transmission) or that record contacts (tracing) need the contacts
+
+        can_transmit=infectious>0
+
+        rows=np.flatnonzero(active&started&(can_transmit|record_contacts))
+
+        if len(rows)>0:
+
+            ei,ej,block_offsets,end_slot=network.contacts_between(first_slot,end_slot)
+
+            # (replicates) x (contacts) arrays of the states of both students, found before the exposures of the block change them;
+            # students of all replicates are indexed as replicate*N_students+student in the flattened state arrays
+
+            flat_i=rows[:,None]*N_students+ei
+            flat_j=rows[:,None]*N_students+ej
+
+            si=state.ravel().take(flat_i)
+            sj=state.ravel().take(flat_j)
+
+            # contacts count (are recorded for tracing and can transmit) unless both students are susceptible or either is in quarantine
+
+            both_susceptible=(si==susceptible)&(sj==susceptible)
+            quarantined=in_quarantine.ravel().take(flat_i)|in_quarantine.ravel().take(flat_j)
+
+            if params['oddweeks']: # with the interleaving intervention, contacts with a student who is not present this week do not take place either
+
+                parity=(curr_time//week)%2
+
+                quarantined|=(oddweek.ravel().take(flat_i)!=parity)|(oddweek.ravel().take(flat_j)!=parity)
+
+            counted=~(both_susceptible|quarantined)
+
+            if can_transmit[rows].any():
+
+                i_to_j=counted&is_infectious.ravel().take(flat_i)&(sj==susceptible)
+                j_to_i=counted&is_infectious.ravel().take(flat_j)&(si==susceptible)
+
+                candidate_rows,candidates=np.nonzero(i_to_j|j_to_i) # by replicate, then in time order
+
+                from_i=i_to_j[candidate_rows,candidates]
+
+                sources=np.where(from_i,flat_i[candidate_rows,candidates],flat_j[candidate_rows,candidates]) # flat indices
+                targets=np.where(from_i,ej[candidates],ei[candidates])
+
+                candidate_rows=rows[candidate_rows] # replicate of each candidate
+
+                # a draw for each contact (i,j,time) with the key of each replicate (see Population)
+
+                draws=common_uniforms(transmission_keys[candidate_rows],ei[candidates],ej[candidates],network.times[first_slot+np.searchsorted(block_offsets,candidates,side='right')-1]+periodic_boundary_modifier)
+
+                hits=np.flatnonzero(draws<p_transmission*dampingfactor.ravel().take(sources))
+
+                if len(hits)>0:
+
+                    # only the first successful contact of each target in each replicate counts; exposures in time order
+
+                    unique_hits,first_hits=np.unique(candidate_rows[hits]*N_students+targets[hits],return_index=True)
+
+                    hits=hits[first_hits]
+
+                    hits=hits[np.lexsort((candidate_rows[hits],candidates[hits]))]
+
+                    exposed_rows=candidate_rows[hits]
+                    exposed_at=candidates[hits]
+                    exposed_targets=targets[hits]
+                    exposed_slots=first_slot+np.searchsorted(block_offsets,exposed_at,side='right')-1
+
+                    for n in xrange(0,len(hits)):
+
+                        if exposed_slots[n]>=end_slot: # an exposure scheduled an event before this slot, so handle that first
+
+                            break
+
+                        r=exposed_rows[n]
+
+                        studentlists[r][exposed_targets[n]].exposure(eventqs[r],int(network.times[exposed_slots[n]])+periodic_boundary_modifier,params)
+
+                        exposed[r]+=1
+                        total_infected[r]+=1
+
+                        next_event[r]=eventqs[r].next_time()
+
+                        end_slot=min(end_slot,max(exposed_slots[n]+1,np.searchsorted(network.times,int(next_event[r])-periodic_boundary_modifier)))
+
+                    took_place=(exposed_slots<end_slot)&record_contacts[exposed_rows]
+
+                    # contacts of a newly exposed student with susceptibles after the exposure count too (for tracing)
+
+                    if took_place.any():
+
+                        exposed_index=np.full((replicates,N_students),len(ei))
+                        exposed_index[exposed_rows[took_place],exposed_targets[took_place]]=exposed_at[took_place]
+
+                        exposed_index=exposed_index[rows]
+
+                        contact_index=np.arange(len(ei))
+
+                        counted|=both_susceptible&~quarantined&((contact_index>exposed_index[:,ei])|(contact_index>exposed_index[:,ej]))
+
+            if record_contacts[rows].any():
+
+                # the other replicates count none of the contacts of the block (all rows are written, so none keeps older flags)
+
+                recorded=np.zeros((replicates,block_offsets[end_slot-first_slot]),dtype=bool)
+                recorded[rows]=counted[:,:block_offsets[end_slot-first_slot]]&record_contacts[rows][:,None]
+
+                trace.record(first_slot,end_slot,periodic_boundary_modifier,recorded,network,rows=slice(None))
+
+        slot=end_slot
+
+        if slot==len(network.times): # wrap around to the beginning of the data
+
+            slot=0
+            periodic_boundary_modifier+=max_time+300
+
+    results=[]
+
+    for r in xrange(0,replicates):
+
+        fq=float(false_quarantines[r])/quarantines[r] if quarantines[r]>0 else 0.0
+
+        results.append((total_infected[r],quarantines[r],fq))
+
+    return results
+
+if __name__=="__main__":
+
+    network=read_contacts()
+
+    # with --worker host:port the script only does runs for the sweep coordinated at host:port (see sweep_worker),
+    # with --coordinator host:port the runs of the sweep are done by such workers; SWEEP_AUTHKEY is their shared key.
+    # With --resume, a sweep outside a SLURM job array resumes the sweep with the same parameters in results, and with
+    # --resume=base_seed the one with that base seed (otherwise it is a new sweep, with a new base seed)
+
+    arguments=sys.argv[1:]
+
+    resumed=[argument for argument in arguments if argument.split('=')[0]=='--resume']
+
+    arguments=[argument for argument in arguments if not(argument in resumed)]
+
+    resume=len(resumed)>0
+    resumed_seed=int(resumed[-1].split('=')[1]) if resume and '=' in resumed[-1] else None
+
+    role=None
+
+    if len(arguments)>=2 and arguments[0] in ['--worker','--coordinator']:
+
+        role=arguments[0][2:]
+        address=parse_address(arguments[1])
+
+        arguments=arguments[2:]
+
+    authkey=os.environ.get('SWEEP_AUTHKEY')
+
+    if role=='worker':
+
+        sweep_worker(address,network,authkey,processes=int(os.environ.get('SLURM_CPUS_PER_TASK',1)))
+
+        sys.exit(0)
+
+    # the sweep: from a JSON config file given as the argument (see read_sweep_config), or the default one below
+
+    if len(arguments)>0:
+
+        sweep=read_sweep_config(arguments[0])
+
+    else:
+
+        params=dict(default_intervention_params)
+
+        params['manual_tracing_threshold']=2
+        params['app_tracing_threshold']=2
+        params['p_tested']=0.5
+
+        sweep={'params':params,'iterations':100}
+
+    # the tasks of a SLURM job array share one sweep (with the same base seed), each array task doing its share of the runs;
+    # by default each array task does as many runs as iterations (as when every array task ran a sweep of its own).
+    # A requeued (e.g. pre-empted) array task gets the same base seed and shard, and always resumes from its checkpoints
+
+    shard=slurm_shard() if role is None else None
+
+    if shard is not None:
+
+        base_seed=int(os.environ['SLURM_ARRAY_JOB_ID'])%(2**31-1)
+
+        resume=True
+
+        if len(arguments)==0:
+
+            sweep['iterations']*=shard[1]
+
+    else:
 
-    contactdict,student_ids=read_contacts()
+        base_seed=resumed_seed
 
-    params=default_intervention_params
+    if role=='coordinator':
 
-    params['manual_tracing_threshold']=2
-    params['app_tracing_threshold']=2
-    params['p_tested']=0.5
+        sweep.update(coordinator=address,authkey=authkey)
 
-    episizes_tracing_cluster(contactdict,student_ids,params,iterations=100)
+    episizes_tracing_cluster(network,processes=int(os.environ.get('SLURM_CPUS_PER_TASK',1)),base_seed=base_seed,results_dir='results',resume=resume,shard=shard,**sweep)
 
     
 